@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+This script turns the MD&A extracts in mda_extract/ into a tokenized corpus stored in mda_corpus/: one vocabulary file, one file with all token IDs (memory-mapped when reading) and a document index with the offset and length of every filing per Central Index Key and filing date. The downstream scripts can read the tokens without decoding and splitting the text files again. Running the script again only appends the filings that are not in the corpus yet.
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import re
+from tqdm import tqdm
+
+from master_index import load_master_index
+from pack_store import open_document, document_size
+
+###############################################################################
+input_directory = './mda_extract/'
+corpus_directory = './mda_corpus/'
+master_index_df = 'master_index/master_index_filtered.csv'
+
+vocabulary_file = 'vocabulary.txt'
+tokens_file = 'tokens.bin'
+documents_file = 'documents.csv'
+
+token_dtype = np.uint32
+documents_columns = ['File', 'CIK', 'Date Filed', 'Offset', 'Length', 'Size', 'Empty']
+
+###############################################################################
+# Tokenization shared by all metrics (see mda_analysis.py): the lower case runs of word characters
+
+word_token = re.compile(r'\w+')
+
+def tokenize_extract(data):
+    return word_token.findall(data.lower())
+
+###############################################################################
+# Vocabulary: one word per line, the line number is the token ID
+# Words are runs of word characters so they never contain a newline
+
+def load_vocabulary(directory=corpus_directory):
+    if not os.path.isfile(directory + vocabulary_file):
+        return []
+    with open(directory + vocabulary_file, 'r', encoding='utf-8', newline='\n') as f:
+        return f.read().split('\n')[:-1]
+
+def load_documents(directory=corpus_directory):
+    if not os.path.isfile(directory + documents_file):
+        return pd.DataFrame(columns = documents_columns)
+    return pd.read_csv(directory + documents_file, sep = ',', dtype = {'Date Filed': str})
+
+###############################################################################
+# Below function appends the filings of the master index that are not in the corpus yet
+# Token IDs are written first, then the new words and finally the document index: the document index is only
+# updated once the tokens are on disk, so an interrupted run is simply continued the next time
+
+def build_corpus(master_index_df, input_dir=input_directory, directory=corpus_directory):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    vocabulary = load_vocabulary(directory)
+    vocabulary_index = {word: token_id for (token_id, word) in enumerate(vocabulary)}
+    vocabulary_size = len(vocabulary)
+
+    documents_df = load_documents(directory)
+    stored_files = set(documents_df['File'])
+    if documents_df.shape[0] > 0:
+        offset = int((documents_df['Offset'] + documents_df['Length']).max())
+    else:
+        offset = 0
+
+    new_documents = []
+    mode = 'r+b' if os.path.isfile(directory + tokens_file) else 'wb'
+    with open(directory + tokens_file, mode) as tokf:
+        # Drop tokens of an interrupted run that never made it into the document index
+        tokf.seek(offset * np.dtype(token_dtype).itemsize)
+        tokf.truncate()
+
+        with tqdm(total=master_index_df.shape[0]) as pbar:
+            for file, cik, date_filed in zip(master_index_df['File'], master_index_df['CIK'], master_index_df['Date Filed']):
+                pbar.update(1)
+                if file in stored_files:
+                    continue
+                try:
+                    with open_document(input_dir, file) as f:
+                        data = f.read()
+                    size = document_size(input_dir, file)
+                except Exception as e:
+                    print(e)
+                    continue
+
+                token_ids = []
+                for word in tokenize_extract(data):
+                    token_id = vocabulary_index.get(word)
+                    if token_id is None:
+                        token_id = len(vocabulary)
+                        vocabulary_index[word] = token_id
+                        vocabulary.append(word)
+                    token_ids.append(token_id)
+
+                tokf.write(np.array(token_ids, dtype = token_dtype).tobytes())
+                new_documents.append((file, cik, date_filed, offset, len(token_ids), size, data == ''))
+                stored_files.add(file)
+                offset += len(token_ids)
+
+    with open(directory + vocabulary_file, 'a', encoding='utf-8', newline='\n') as f:
+        for word in vocabulary[vocabulary_size:]:
+            f.write(word + '\n')
+
+    new_documents_df = pd.DataFrame(new_documents, columns = documents_columns)
+    new_documents_df.to_csv(directory + documents_file, mode = 'a', index = False,
+                            header = not os.path.isfile(directory + documents_file))
+
+    return new_documents_df.shape[0]
+
+###############################################################################
+# Reading the corpus: the token IDs are memory-mapped, so slicing a document does not copy any data
+# https://numpy.org/doc/stable/reference/generated/numpy.memmap.html
+
+def open_corpus(directory=corpus_directory):
+    vocabulary = load_vocabulary(directory)
+    documents_df = load_documents(directory)
+    documents_df = documents_df.set_index('File', drop = False)
+
+    if os.path.isfile(directory + tokens_file) and os.path.getsize(directory + tokens_file) > 0:
+        tokens = np.memmap(directory + tokens_file, dtype = token_dtype, mode = 'r')
+    else:
+        tokens = np.zeros(0, dtype = token_dtype)
+
+    return {'vocabulary': vocabulary,
+            'vocabulary_index': {word: token_id for (token_id, word) in enumerate(vocabulary)},
+            'words': np.array(vocabulary, dtype = object),
+            'word_lengths': np.array([len(word) for word in vocabulary], dtype = np.int32),
+            'tokens': tokens,
+            'documents': documents_df}
+
+def document_tokens(corpus, file):
+    document = corpus['documents'].loc[file]
+    return corpus['tokens'][int(document['Offset']) : int(document['Offset']) + int(document['Length'])]
+
+# Token IDs converted back into words (only needed for consumers working on strings)
+
+def document_words(corpus, file):
+    return corpus['words'][document_tokens(corpus, file)].tolist()
+
+# Documents of one Central Index Key sorted by filing date
+
+def cik_documents(corpus, cik):
+    documents_df = corpus['documents']
+    return documents_df[documents_df['CIK'] == cik].sort_values(by=['Date Filed'], ascending=True)
+
+###############################################################################
+if __name__ == '__main__':
+    # Once again we are reading the master index and adding the relative paths to the files
+    master_index_df = load_master_index(master_index_df)
+
+    number_of_documents = build_corpus(master_index_df, input_directory, corpus_directory)
+    print('Number of documents added to the corpus: ', number_of_documents)
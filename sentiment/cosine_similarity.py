@@ -7,14 +7,17 @@ Version 1.0 dated 04-Apr-2020
 This script will calculate the change of language in the MD&A sections (comparing one year to the next) and the output is stored in a JSON format containing a nested structure of data and score per Central Index Key. The equivalent is also stored in a log file in logs/, whereas in results/ you can find the JSON file.
 """
 
-import numpy as np
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import CountVectorizer
 import os
 from tqdm import tqdm
 import json
 
+from corpus_store import open_corpus
+from similarity import tfidf_input_counts, tfidf_matrix, pair_similarity, grouped_tfidf_matrix, lagged_pairs
+from similarity import fit_idf, save_idf, load_idf, apply_idf, corpus_idf_vector
+from master_index import load_master_index, sort_by_group, group_ids, iter_groups
+from pack_store import open_document, document_size
+
 ###############################################################################
 # We are taking the output of the download_clean_10k script.
 # For 99.5% of the cases we have the right extraction, some other cases require to clean up once again.
@@ -54,8 +57,7 @@ stemmer_enabled = False
 ###############################################################################
 # Once again we are reading the master index and adding the relative paths to the files
 
-master_index_df = pd.read_csv(master_index_df, sep = ',')
-master_index_df['File'] = master_index_df['TXT'].str.split('/', expand = True)[6] + '/' + master_index_df['TXT'].str.split('/', expand = True)[7]
+master_index_df = load_master_index(master_index_df)
 
 ###############################################################################
 # Define log files to inspect the processing
@@ -64,79 +66,175 @@ master_index_df['File'] = master_index_df['TXT'].str.split('/', expand = True)[6
 if not os.path.exists(log_directory):
     os.makedirs(log_directory)
 
-statsf = open(log_directory + cosine_stats_file, 'w')
-cos_sim_results_dict = {}
-
 cik_df = master_index_df['CIK'].unique()
 
 # Not all MD&A reports can be extracted corrctly or sometimes refer to obscure page numbering (that afterwards gets lost in the way the original file is stored)
 # We found that below 2 KB we have this behaviour consistently
 mda_size_threshold = 2048
 
+# Lags to compare: 1 compares every filing with the previous one (similarity_stats.json), 2 with the one before that and so on
+# The results of the other lags are stored in similarity_lag<lag>_stats.json and .log (e.g. multi-year drift)
+similarity_lags = [1]
+
+def lag_file_name(file_name, lag):
+    if lag == 1:
+        return file_name
+    return file_name.replace('similarity_', 'similarity_lag' + str(lag) + '_')
+
+# The IDF is fitted per CIK ('cik') or once over the whole corpus ('corpus') so that the scores can be compared across companies
+# The corpus-wide IDF is fitted on the filings of idf_years (first and last year included, None takes all filings) and stored in idf_file
+# Once stored it is reused as is, delete the file to fit it again
+idf_mode = 'cik'
+idf_years = None
+idf_file = 'similarity_idf.npz'
+
+def idf_fit_rows(date_list):
+    if idf_years is None:
+        return None
+    return [idf_years[0] <= int(dt[:4]) <= idf_years[1] for dt in date_list]
+
+# Incremental mode only scores the filings that are not in similarity_stats.json yet, based on the tokenized corpus of corpus_store.py
+# The IDF is still fitted on the full history of the CIK (as in a full run), the existing scores are kept as they are
+incremental_mode = False
+corpus_directory = './mda_corpus/'
+
+def incremental_similarity(corpus, loop_df, cik_results, lag):
+    loop_df = loop_df[loop_df['File'].isin(corpus['documents'].index)]
+    file_list = list(loop_df['File'])
+    date_list = list(loop_df['Date Filed'])
+
+    # Cosine similarity goes into effect on the latter date of each pair, we only need the pairs ending on a new date
+    new_pairs = [index for index in range(lag, len(file_list)) if date_list[index] not in cik_results]
+    if len(new_pairs) == 0:
+        return cik_results
+
+    if idf_mode == 'corpus':
+        tfidf = apply_idf(tfidf_input_counts(corpus, file_list), corpus_idf)
+    else:
+        tfidf = tfidf_matrix(tfidf_input_counts(corpus, file_list))
+    cos_sim_result = pair_similarity(tfidf, [index-lag for index in new_pairs], new_pairs)
+    size_list = list(corpus['documents'].loc[file_list, 'Size'] < mda_size_threshold)
+
+    for index, cs in zip(new_pairs, cos_sim_result):
+        cik_results[date_list[index]] = float(round(cs, 4)) if not size_list[index] and not size_list[index-lag] else 1.0
+
+    return dict(sorted(cik_results.items()))
+
 # In below code we will calculate the cosine similarity after performing TF-IDF
 # We did not opt to calculate the Jaccard similarity measure as the cosine one is better
 # Jaccard suffers from a bias towards longer document and not taking into account term frequency
 # Important remark here is that we are not stemming or cleaning the extracts
 # Running the code with a stemmer didn't give any noticeable difference in the results
 
-# Include progress bar (tqdm library)
-with tqdm(total=len(cik_df)) as pbar:
-    for cik in cik_df:
-        pbar.update(1)
-        loop_df = master_index_df[master_index_df['CIK'] == cik].sort_values(by=['Date Filed'], ascending=True)
-
-        tfidf_input = []
-        # We'll store the size of the files and the filed dates in separate lists for easier processing
-        # size_list contains booleans for those files below the threshold
-        size_list = []
-        date_list = []
-        for index, row in loop_df.iterrows():
-            try:
-                with open(input_directory + row['File'], 'r+', encoding = 'mbcs') as f:
-                    data = f.read()
-                    if data == '':
-                        tfidf_input.append(stemmer('empty', stemmer_enabled))
-                    else:
-                        tfidf_input.append(stemmer(data, stemmer_enabled))
-                    size_list.append(os.path.getsize(input_directory + row['File']) < mda_size_threshold)
-                    date_list.append(row['Date Filed'])
-                f.close()
-            except Exception as e:
-                print(e)
-                tfidf_input.append('empty')
-        # Cosine similarity compares two values, so we'll get a result that's one less in lenght
-        # If the preceding entry was below the treshold, then we need to correct: remove the last entry as we compare to the previous
-        # For the dates, we remove the first entry as the cosine similarity goes into effect on the latter date
-        date_list.pop(0)
-        size_list_shifted = size_list.copy()
-        size_list_shifted.pop()
-        size_list.pop(0)
-        # Term frequency-inverse document frequency weighing
-        # https://nlp.stanford.edu/IR-book/html/htmledition/tf-idf-weighting-1.html
-        # https://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.TfidfVectorizer.html
-        # Example on http://blog.christianperone.com/2011/10/machine-learning-text-feature-extraction-tf-idf-part-ii/
-        # https://www.analyticsvidhya.com/blog/2017/06/word-embeddings-count-word2veec/
-        tfidf_vectorizer = TfidfVectorizer()
-        tfidf_matrix = tfidf_vectorizer.fit_transform(tfidf_input)
-        cos_sim = cosine_similarity(tfidf_matrix)
-        cos_sim_result = [round(x, 4) for x in np.diag(cos_sim, k=1)]
-
-        cos_sim_corrected_result = [cs if not sz and not szs else 1.0 for (cs, sz, szs) in zip(cos_sim_result, size_list, size_list_shifted)]
-        # import matplotlib.pyplot as plt
-        # plt.hist(cos_sim_corrected_result, bins = 5)
-        # plt.show()
-
-        cos_sim_results_dict[str(cik)] = {dt:cs for (cs, dt) in zip(cos_sim_corrected_result, date_list)}
-
-        for cs, dt in zip(cos_sim_corrected_result, date_list):
-            statsf.write(str(cik) + ',' + str(dt) + ',' + str(cs) +'\n')
+cos_sim_results_dict = {lag: {} for lag in similarity_lags}
+
+if incremental_mode:
+    for lag in similarity_lags:
+        if os.path.isfile(output_directory + lag_file_name(cosine_json_file, lag)):
+            with open(output_directory + lag_file_name(cosine_json_file, lag), 'r') as f:
+                cos_sim_results_dict[lag] = json.load(f)
+    corpus = open_corpus(corpus_directory)
+
+    if idf_mode == 'corpus':
+        if not os.path.isfile(output_directory + idf_file):
+            # Fit on all filings of the tokenized corpus, the last column holds the empty extracts (see similarity.py)
+            documents_df = corpus['documents']
+            counts = tfidf_input_counts(corpus, list(documents_df['File']))
+            idf = fit_idf(counts, idf_fit_rows(list(documents_df['Date Filed'])))
+            if not os.path.exists(output_directory):
+                os.makedirs(output_directory)
+            save_idf(output_directory + idf_file, corpus['vocabulary'] + ['empty'], idf)
+        idf_vocabulary, idf = load_idf(output_directory + idf_file)
+        corpus_idf = corpus_idf_vector(idf_vocabulary, idf, corpus)
+
+    # Include progress bar (tqdm library)
+    with tqdm(total=len(cik_df)) as pbar:
+        for cik, loop_df in iter_groups(master_index_df, 'cik'):
+            pbar.update(1)
+
+            for lag in similarity_lags:
+                cos_sim_results_dict[lag][str(cik)] = incremental_similarity(corpus, loop_df, cos_sim_results_dict[lag].get(str(cik), {}), lag)
+
+else:
+    # All CIKs are processed in one batch: one term count matrix for the whole corpus, ordered by CIK and filing date (as the master index)
+    batch_df = sort_by_group(master_index_df, 'cik')
+    batch_df = batch_df.assign(CIK_order = group_ids(batch_df, 'cik'))
+
+    # We'll store the index, the size of the files (booleans for those files below the threshold) of the files we could read
+    read_list = []
+    size_list = []
+
+    def read_corpus(df):
+        with tqdm(total=df.shape[0]) as pbar:
+            for index, file in zip(df.index, df['File']):
+                pbar.update(1)
+                try:
+                    with open_document(input_directory, file) as f:
+                        data = f.read()
+                    size = document_size(input_directory, file)
+                except Exception as e:
+                    print(e)
+                    continue
+                read_list.append(index)
+                size_list.append(size < mda_size_threshold)
+                if data == '':
+                    yield stemmer('empty', stemmer_enabled)
+                else:
+                    yield stemmer(data, stemmer_enabled)
+
+    # Term frequency-inverse document frequency weighing
+    # https://nlp.stanford.edu/IR-book/html/htmledition/tf-idf-weighting-1.html
+    # https://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.TfidfVectorizer.html
+    # Example on http://blog.christianperone.com/2011/10/machine-learning-text-feature-extraction-tf-idf-part-ii/
+    # https://www.analyticsvidhya.com/blog/2017/06/word-embeddings-count-word2veec/
+    # Same tokenization as the TfidfVectorizer, the IDF is computed per CIK in grouped_tfidf_matrix (see similarity.py)
+    # With a stored corpus-wide IDF we only transform with its vocabulary
+    idf_stored = idf_mode == 'corpus' and os.path.isfile(output_directory + idf_file)
+    if idf_stored:
+        idf_vocabulary, idf = load_idf(output_directory + idf_file)
+        count_vectorizer = CountVectorizer(vocabulary = idf_vocabulary)
+        counts = count_vectorizer.transform(read_corpus(batch_df))
+    else:
+        count_vectorizer = CountVectorizer()
+        counts = count_vectorizer.fit_transform(read_corpus(batch_df))
+
+    read_df = batch_df.loc[read_list]
+    cik_order = read_df['CIK_order'].values
+    cik_list = list(read_df['CIK'])
+    date_list = list(read_df['Date Filed'])
+
+    if idf_mode == 'corpus':
+        if not idf_stored:
+            idf_vocabulary = sorted(count_vectorizer.vocabulary_, key = count_vectorizer.vocabulary_.get)
+            idf = fit_idf(counts, idf_fit_rows(date_list))
+            if not os.path.exists(output_directory):
+                os.makedirs(output_directory)
+            save_idf(output_directory + idf_file, idf_vocabulary, idf)
+        tfidf = apply_idf(counts, idf)
+    else:
+        tfidf = grouped_tfidf_matrix(counts, cik_order)
+
+    # Cosine similarity compares two values, so we'll get a result that's one less in lenght per lag
+    # If one of both entries was below the treshold, then we need to correct
+    # The dates are the ones of the latter filing as the cosine similarity goes into effect on the latter date
+    for lag in similarity_lags:
+        first_rows, second_rows = lagged_pairs(cik_order, lag)
+        cos_sim_result = pair_similarity(tfidf, first_rows, second_rows)
+
+        cos_sim_results_dict[lag] = {str(cik): {} for cik in cik_df}
+        for first, second, cs in zip(first_rows, second_rows, cos_sim_result):
+            cos_sim_corrected_result = float(round(cs, 4)) if not size_list[first] and not size_list[second] else 1.0
+            cos_sim_results_dict[lag][str(cik_list[second])][date_list[second]] = cos_sim_corrected_result
 
 # Verify existence of output directory and create if not exists
 if not os.path.exists(output_directory):
     os.makedirs(output_directory)
 
-with open(output_directory + cosine_json_file, 'w') as f:
-    json.dump(cos_sim_results_dict, f)
-    f.close()
+for lag in similarity_lags:
+    with open(log_directory + lag_file_name(cosine_stats_file, lag), 'w') as statsf:
+        for cik, cik_results in cos_sim_results_dict[lag].items():
+            for dt, cs in cik_results.items():
+                statsf.write(str(cik) + ',' + str(dt) + ',' + str(cs) +'\n')
 
-statsf.close()
\ No newline at end of file
+    with open(output_directory + lag_file_name(cosine_json_file, lag), 'w') as f:
+        json.dump(cos_sim_results_dict[lag], f)
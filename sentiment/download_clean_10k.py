@@ -7,12 +7,17 @@ Version 1.0 dated 31-Mar-2020
 This script downloads the annual reports and already filters out the binary files along with cleaning up the data structure in the raw text files. Unprocessed download size is 500 GB. We ran this particular script on multiple Azure Data Science Virtual Machines. The script already contains process parallelization to facilitate the download. The result is stored in download/ and has one folder per Central Index Key (company).
 """
 
-import pandas as pd
-import wget
-import re
 import os
+import argparse
 from threading import Thread
-import multiprocessing
+import asyncio
+
+from edgar_submission import clean_submission, store_clean_submission, clean_stored_submission
+from job_ledger import ledger_file, cleaned, failed, open_ledger, register_filings, filings_to_process, record_attempt, completed_files
+from work_scheduler import run_scheduled, worker_report
+from shard import parse_shard, select_shard, shard_suffix, write_manifest
+from master_index import load_master_index
+from raw_store import raw_directory, keep_raw_submissions, accession_of, is_stored
 
 ###############################################################################
 # Filtered master index file from edgar_master_index_zip.py
@@ -21,22 +26,58 @@ import multiprocessing
 master_index_df = 'master_index/master_index_filtered.csv'
 output_directory = './edgar_download/'
 
+###############################################################################
+# Below function downloads and cleans one filing given as (file, CIK, URI, download path)
+# Used by dl_clean_10k and by the worker processes of dl_clean_10k_scheduled, the caller records the result in the job ledger
+# Returns the file and the error message (None when successful)
+
+def dl_clean_filing(filing):
+    # Only these downloads use wget, the asyncio version (edgar_fetch.py) does not need it installed
+    import wget
+
+    file, cik, txt, dl_dir = filing
+    try:
+        link_dir = dl_dir + str(cik)  + '/'
+        if not os.path.exists(link_dir):
+            os.makedirs(link_dir, exist_ok = True)
+
+        # A submission that is already in the raw store (e.g. the same filing under another filer) is not downloaded again
+        if keep_raw_submissions and is_stored(accession_of(file), raw_directory):
+            clean_stored_submission(dl_dir + file, accession_of(file), raw_directory)
+            return file, None
+
+        # wget does not overwrite, an incomplete file of an earlier attempt would end up next to the new one
+        if os.path.isfile(dl_dir + file):
+            os.remove(dl_dir + file)
+
+        link = wget.download(txt, out = link_dir)
+
+        # Only the 10-K document is read from the submission, inline spreadsheets, images and so on are skipped without decoding
+        # The submission is then overwritten by the cleaned 10-K document (see edgar_submission.py), the raw submission is kept in the raw store
+        if keep_raw_submissions:
+            store_clean_submission(link, accession_of(file), raw_directory)
+        else:
+            clean_submission(link)
+    except Exception as e:
+        return file, str(e)
+    return file, None
+
 ###############################################################################
 # In order to download the 10-K forms (hosted on SEC EDGAR), we'll need to process nearly 500 GB of data
-# Below function takes four arguments:
+# Below function takes five arguments:
     # dataframe that contains the download URIs
     # download path
     # chunk parameter: which section of the download list get processed
     # chunk total parameter: total number of chunks
+    # resume parameter: also retry the filings that failed or were not cleaned in an earlier run
 
-def dl_clean_10k(df, dl_dir, chunk, chunk_total):
+def dl_clean_10k(df, dl_dir, chunk, chunk_total, resume=False):
 
     # Add log file for incomplete downloads and/or other messages
     log_file = 'dl_error' + str(chunk) + '.log'
 
     # Read in master index and append target CIK subdirectory and file
-    master_index_df = pd.read_csv(df, sep = ',')
-    master_index_df['File'] = master_index_df['TXT'].str.split('/', expand = True)[6] + '/' + master_index_df['TXT'].str.split('/', expand = True)[7]
+    master_index_df = load_master_index(df)
 
     # Logic to chunk the master index into different ranges
     range_len = int(round(int(master_index_df.shape[0]) / int(chunk_total), 0))
@@ -51,65 +92,61 @@ def dl_clean_10k(df, dl_dir, chunk, chunk_total):
     master_index_df = master_index_df[df_range_start:df_range_end]
 
 
-    # Verify existence of output directory and create if not exists
+    # Verify that output path already exists, otherwise create (wget falls over otherwise)
     if not os.path.exists(dl_dir):
         os.makedirs(dl_dir)
 
     logf = open(log_file, "w")
 
-    for index, row in master_index_df.iterrows():
-        if os.path.isfile(output_directory  + row['File']):
-            # print('File exists: {0}'.format(str(row['File'])))
-            # logf.write('File exists: {0}\n'.format(str(row['File'])))
-            pass
-        else:
-            try:
-                link_dir = output_directory + str(row['CIK'])  + '/'
-                if not os.path.exists(link_dir):
-                    os.makedirs(link_dir)
-
-                link = wget.download(row['TXT'], out = link_dir)
-
-                with open(link, 'r+') as f:
-                    data = f.read()
-
-                    f.seek(0)
-                    # The following line will remove inline spreadsheets, images and so on
-                    # Aim is to reduce file size drastically here (10-K reports can easily be tens to hundreds of MB in size)
-                    # With those two lines we bring that down to about 1 MB and that contains the textual information of the 10-K
-                    find_indices = [m for m in re.finditer('<DOCUMENT>\n<TYPE>10-K[\s\S]*?<\/DOCUMENT>', data, flags=re.I)]
-                    data = data[find_indices[0].start():find_indices[0].end()]
-                    # Refer to extract_mda.py for reasons behind the below (as we started that code first before scaling to the entire dataset)
-                    data = re.sub('\n', ' ', data)
-                    data = re.sub('>', '>\n', data)
-                    data = re.sub('<.*?>','', data)
-                    data = re.sub('&nbsp;', ' ', data)
-                    data = re.sub(' {2,}', ' ', data)
-                    data = re.sub('/&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});','', data)
-                    data = re.sub('\/s\/\s|\/s\/','', data)
-                    data = re.sub('[^0-9a-zA-Z][\s\t]+?&-\/\'', '', data)
-                    data = re.sub('&#\d*;','', data)
-                    data = re.sub('\n\s*\n','\n', data)
-
-                    f.truncate()
-                    f.write(data)
-                    f.close()
-
-            except Exception as e:
-                # print('Failed to download {0}: {1}\n'.format(str(row['File']), str(e))
-                logf.write('Failed to download {0}: {1}\n'.format(str(row['File']), str(e)))
+    # The job ledger (see job_ledger.py) tells which filings are still to do, so the download directory is not checked file by file
+    # With resume, the filings that failed before or were not cleaned are retried as well
+    ledger = open_ledger(ledger_file)
+    register_filings(ledger, master_index_df, dl_dir)
+    chunk_files = set(master_index_df['File'])
+
+    for file, cik, txt in filings_to_process(ledger, resume):
+        if file not in chunk_files:
+            continue
+        file, error = dl_clean_filing((file, cik, txt, dl_dir))
+        record_attempt(ledger, file, cleaned if error is None else failed, error)
+        if error is not None:
+            # print('Failed to download {0}: {1}\n'.format(str(file), error)
+            logf.write('Failed to download {0}: {1}\n'.format(str(file), error))
+    ledger.close()
     logf.close()
 
+###############################################################################
+# Same as dl_clean_10k for the whole master index (or one shard of it, see shard.py)
+# The filings are handed out to the processes in small batches on demand (see work_scheduler.py)
+# The size of a submission is only known after the download, so the batches are balanced on the number of filings
+
+def dl_clean_10k_scheduled(master_index_df, dl_dir, workers, resume=False, ledger_path=ledger_file):
+    # Verify that output path already exists, otherwise create (wget falls over otherwise)
+    if not os.path.exists(dl_dir):
+        os.makedirs(dl_dir)
+
+    ledger = open_ledger(ledger_path)
+    register_filings(ledger, master_index_df, dl_dir)
+    filings = [(file, cik, txt, dl_dir) for (file, cik, txt) in filings_to_process(ledger, resume)]
+
+    worker_stats = {}
+    with open('dl_error.log', 'w') as logf:
+        for results in run_scheduled(dl_clean_filing, filings, [0] * len(filings), workers, worker_stats, batch_items = download_batch_items):
+            for file, error in results:
+                record_attempt(ledger, file, cleaned if error is None else failed, error)
+                if error is not None:
+                    logf.write('Failed to download {0}: {1}\n'.format(str(file), error))
+    ledger.close()
+
+    for line in worker_report(worker_stats):
+        print(line)
+
 # # dl_clean_10k(master_index_df, output_directory, 1, 5)
 # # dl_clean_10k(master_index_df, output_directory, 2, 5)
 # # dl_clean_10k(master_index_df, output_directory, 3, 5)
 # # dl_clean_10k(master_index_df, output_directory, 4, 5)
 # # dl_clean_10k(master_index_df, output_directory, 5, 5)
 
-# Verify that output path already exists, otherwise create (wget falls over otherwise)
-if not os.path.exists(output_directory):
-    os.makedirs(output_directory)
-
 # Implementation with concurrent threads to speed up downloading
 # concurrent_threads = 5
 # threads = []
@@ -124,20 +161,43 @@ if not os.path.exists(output_directory):
 # Implementation with concurrent processes to speed up downloading
 # Number of processes to be tweaked in function of CPO
 # In the end we ran three machines concurrently on yet another subset (above)
+# The asyncio version (edgar_fetch.py) shares one connection pool and one rate limit over all downloads, set to False for the processes below
+async_download = True
+# Retry the filings that failed or were not cleaned in an earlier run (see job_ledger.py)
+resume = False
+# Number of filings per batch handed out to a download process (see work_scheduler.py)
+download_batch_items = 10
+
+# Run on several machines with --shard i/N: every machine downloads the companies of its shard and writes a manifest
+# of its completed files, see shard.py for merging the results
+
 if __name__ == '__main__':
-    concurrent_processes = 5
-    processes = []
-    for index in range(concurrent_processes):
-        process = multiprocessing.Process(target=dl_clean_10k, args=(master_index_df, output_directory, index+1, concurrent_processes,))
-        processes.append(process)
-        process.start()
-
-    for process in processes:
-        process.join()
-
-# if __name__ == "__main__":
-#     df = sys.argv[1]
-#     dl = sys.argv[2]
-#     chunk = int(sys.argv[3])
-#     chunk_total = int(sys.argv[4])
-#     dl_clean_10k(df, dl, chunk, chunk_total)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = 'Download and clean the 10-K filings of the master index')
+    parser.add_argument('--shard', type = parse_shard, default = None, help = 'only download shard i of N, e.g. 2/5')
+    parser.add_argument('--output', default = output_directory, help = 'download directory')
+    parser.add_argument('--resume', action = 'store_true', default = resume, help = 'retry the filings that failed or were not cleaned')
+    parser.add_argument('--user-agent', default = None, help = 'User-Agent with a contact address for the asyncio version (default: EDGAR_USER_AGENT, see edgar_fetch.py)')
+    args = parser.parse_args()
+    dl_dir = os.path.join(args.output, '')
+    if async_download:
+        # Only the asyncio version needs aiohttp, the processes below run without it
+        from edgar_fetch import dl_clean_10k_async, edgar_user_agent
+        try:
+            user_agent = edgar_user_agent(args.user_agent)
+        except ValueError as e:
+            parser.error(str(e))
+    shard_ledger_file = ledger_file.replace('.sqlite', shard_suffix(args.shard) + '.sqlite')
+
+    master_index_df = load_master_index(master_index_df)
+    master_index_df = select_shard(master_index_df, args.shard)
+
+    if async_download:
+        asyncio.run(dl_clean_10k_async(master_index_df, dl_dir, resume = args.resume, ledger_path = shard_ledger_file, user_agent = user_agent))
+    else:
+        concurrent_processes = 5
+        dl_clean_10k_scheduled(master_index_df, dl_dir, concurrent_processes, args.resume, shard_ledger_file)
+
+    if args.shard is not None:
+        ledger = open_ledger(shard_ledger_file)
+        write_manifest(dl_dir, args.shard, completed_files(ledger))
+        ledger.close()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+This script is the asyncio version of the download in download_clean_10k.py. All requests go through one pooled keep-alive HTTP session (aiohttp) and one global token bucket that keeps us at the SEC EDGAR limit of 10 requests per second. Failed requests are retried a limited number of times with exponential backoff. Cleaning a submission is CPU-bound, so it is handed to a process pool and overlaps with the downloads. The base URL can be pointed to a local web server serving a copy of the archive, e.g. python -m http.server 8000 in a directory with edgar/data/<CIK>/<accession>.txt and then python edgar_fetch.py --base-url http://localhost:8000/
+"""
+
+import aiohttp
+import asyncio
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from edgar_submission import clean_submission, store_clean_submission, clean_stored_submission
+from job_ledger import ledger_file, downloaded, cleaned, failed, open_ledger, register_filings, filings_to_process, start_attempt, set_state
+from master_index import load_master_index
+from raw_store import raw_directory, keep_raw_submissions, accession_of, is_stored
+
+###############################################################################
+master_index_df = 'master_index/master_index_filtered.csv'
+output_directory = './edgar_download/'
+log_file = 'dl_error.log'
+
+# The TXT column of the master index holds the full URI (see edgar_master_index_clean.py), the archive prefix is swapped for base_url
+edgar_archive_uri = 'https://www.sec.gov/Archives/'
+base_url = edgar_archive_uri
+
+# SEC EDGAR fair access: at most 10 requests per second and a User-Agent with a contact address, e.g. "Company Name admin@company.com"
+# https://www.sec.gov/os/accessing-edgar-data
+# There is no default contact: it is given with --user-agent or in the environment variable below, the downloads do not start without it
+requests_per_second = 10
+user_agent_variable = 'EDGAR_USER_AGENT'
+
+# Number of simultaneous downloads (open connections in the pool) and cleaning processes
+concurrent_downloads = 10
+clean_processes = os.cpu_count()
+pending_filings = 100
+
+# Retries with exponential backoff (seconds), e.g. 1, 2, 4, 8 and 16 seconds plus some jitter
+max_retries = 5
+backoff_base = 1.0
+backoff_max = 60.0
+request_timeout = 300
+
+# Status codes worth retrying: throttling and server side errors
+retry_status = {429, 500, 502, 503, 504}
+
+download_chunk_size = 1024*1024
+
+###############################################################################
+# Token bucket shared by all downloads: tokens are added at the given rate up to a burst of one second worth of requests
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def backoff_delay(attempt):
+    return min(backoff_max, backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+# Below function returns the User-Agent to send (the argument, otherwise the environment variable), a ValueError without a contact address
+
+def edgar_user_agent(user_agent=None):
+    user_agent = user_agent or os.environ.get(user_agent_variable, '')
+    if '@' not in user_agent:
+        raise ValueError('SEC EDGAR requires a User-Agent with a contact address, e.g. "Company Name admin@company.com": use --user-agent or set ' + user_agent_variable)
+    return user_agent
+
+def filing_url(txt, base_url=base_url):
+    if txt.startswith(edgar_archive_uri):
+        return base_url + txt[len(edgar_archive_uri):]
+    return txt
+
+###############################################################################
+# Below function downloads one submission to path
+# The response is streamed to a temporary file that is only renamed once complete, so an interrupted download never looks finished
+
+async def fetch_submission(session, bucket, url, path):
+    temporary_path = path + '.part'
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            async with session.get(url) as response:
+                if response.status in retry_status and attempt < max_retries:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                      status = response.status, message = response.reason)
+                response.raise_for_status()
+                with open(temporary_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(download_chunk_size):
+                        f.write(chunk)
+            os.replace(temporary_path, path)
+            return
+        except aiohttp.ClientResponseError as e:
+            if e.status not in retry_status or attempt == max_retries:
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == max_retries:
+                raise
+        await asyncio.sleep(backoff_delay(attempt))
+
+# Download followed by the clean up in the process pool; the download slot is released while the cleaning runs
+# The raw submission is kept in the raw store (see raw_store.py), a submission that is already there is cleaned without downloading it
+# Every step is recorded in the job ledger (see job_ledger.py), failures with the reason
+# Returns None when successful, otherwise the error message for the log
+
+async def download_clean_filing(session, bucket, pool, download_slots, ledger, file, url, path):
+    loop = asyncio.get_running_loop()
+    accession = accession_of(file)
+    start_attempt(ledger, file)
+    try:
+        if keep_raw_submissions and is_stored(accession, raw_directory):
+            await loop.run_in_executor(pool, clean_stored_submission, path, accession, raw_directory)
+            set_state(ledger, file, cleaned)
+            return None
+        async with download_slots:
+            await fetch_submission(session, bucket, url, path)
+        set_state(ledger, file, downloaded)
+        if keep_raw_submissions:
+            await loop.run_in_executor(pool, store_clean_submission, path, accession, raw_directory)
+        else:
+            await loop.run_in_executor(pool, clean_submission, path)
+        set_state(ledger, file, cleaned)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        set_state(ledger, file, failed, error)
+        return error
+    return None
+
+###############################################################################
+# Below function downloads and cleans all filings of the master index that are still pending in the job ledger
+# With resume, the filings that failed before or were not cleaned are retried as well
+
+async def dl_clean_10k_async(master_index_df, dl_dir, base_url=base_url, resume=False, ledger_path=ledger_file, user_agent=None):
+    user_agent = edgar_user_agent(user_agent)
+
+    # Verify existence of output directory and create if not exists
+    if not os.path.exists(dl_dir):
+        os.makedirs(dl_dir)
+
+    ledger = open_ledger(ledger_path)
+    register_filings(ledger, master_index_df, dl_dir)
+
+    bucket = TokenBucket(requests_per_second)
+    download_slots = asyncio.Semaphore(concurrent_downloads)
+    connector = aiohttp.TCPConnector(limit = concurrent_downloads)
+    timeout = aiohttp.ClientTimeout(total = request_timeout)
+    headers = {'User-Agent': user_agent, 'Accept-Encoding': 'gzip, deflate'}
+
+    number_of_files = 0
+
+    with open(log_file, 'w') as logf, ProcessPoolExecutor(max_workers = clean_processes) as pool:
+        async with aiohttp.ClientSession(connector = connector, timeout = timeout, headers = headers) as session:
+
+            async def process_filing(file, url):
+                nonlocal number_of_files
+                error = await download_clean_filing(session, bucket, pool, download_slots, ledger, file, url, dl_dir + file)
+                if error is None:
+                    number_of_files += 1
+                else:
+                    logf.write('Failed to download {0}: {1}\n'.format(str(file), error))
+
+            # The failures of a filing are recorded in the ledger and the log, any other error (e.g. writing the ledger) stops the run
+            async def wait_for(tasks, return_when):
+                done, pending = await asyncio.wait(tasks, return_when = return_when)
+                errors = [task.exception() for task in done if task.exception() is not None]
+                if len(errors) > 0:
+                    raise errors[0]
+                return pending
+
+            # Only a limited number of filings are in progress at any time (downloading, waiting for a token or being cleaned)
+            tasks = set()
+            for file, cik, txt in filings_to_process(ledger, resume):
+                link_dir = dl_dir + str(cik) + '/'
+                if not os.path.exists(link_dir):
+                    os.makedirs(link_dir)
+                if len(tasks) >= pending_filings:
+                    tasks = await wait_for(tasks, asyncio.FIRST_COMPLETED)
+                tasks.add(asyncio.ensure_future(process_filing(file, filing_url(txt, base_url))))
+            if len(tasks) > 0:
+                await wait_for(tasks, asyncio.ALL_COMPLETED)
+
+    ledger.close()
+    return number_of_files
+
+###############################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Download and clean the 10-K filings of the master index')
+    parser.add_argument('--base-url', default = base_url, help = 'archive URL, e.g. http://localhost:8000/ for a local copy')
+    parser.add_argument('--index', default = master_index_df, help = 'filtered master index (CSV)')
+    parser.add_argument('--output', default = output_directory, help = 'download directory')
+    parser.add_argument('--resume', action = 'store_true', help = 'retry the filings that failed or were not cleaned (see job_ledger.py)')
+    parser.add_argument('--user-agent', default = None, help = 'User-Agent with a contact address, e.g. "Company Name admin@company.com" (default: ' + user_agent_variable + ')')
+    args = parser.parse_args()
+    try:
+        user_agent = edgar_user_agent(args.user_agent)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Read in master index and append target CIK subdirectory and file
+    master_index_df = load_master_index(args.index)
+
+    # Paths are built by concatenation, so the directory always ends with a separator
+    dl_dir = os.path.join(args.output, '')
+
+    start = time.perf_counter()
+    number_of_files = asyncio.run(dl_clean_10k_async(master_index_df, dl_dir, args.base_url, args.resume, user_agent = user_agent))
+    print('Downloaded and cleaned {0} filings in {1:.1f} seconds'.format(number_of_files, time.perf_counter() - start))
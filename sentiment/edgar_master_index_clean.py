@@ -8,6 +8,7 @@ This script takes the compressed master index and merges it with the companies l
 """
 
 import glob
+import io
 import pandas as pd
 from zipfile import ZipFile
 
@@ -42,26 +43,41 @@ edgar_index = edgar_archive.namelist()
 # Filter on 10-K and its variants (e.g. 10-K405)
 
 edgar_columns = ['CIK', 'Company Name', 'Form Type', 'Date Filed', 'TXT', 'HTML']
-edgar_df = pd.DataFrame(columns = edgar_columns)
-edgar_df.drop(['HTML'], axis = 1, inplace = True)
 edgar_archive_uri = 'https://www.sec.gov/Archives/'
 
-number_of_rows = 0
-
-for index in edgar_index:
-    compressed_file = edgar_archive.open(index)
-    qtr_df = pd.read_csv(compressed_file, sep = '|', header = None)
-    # Add column headers
-    qtr_df.set_axis(edgar_columns, axis=1, inplace = True)
-    # Drop last column
-    qtr_df.drop(['HTML'], axis = 1, inplace = True)
-    # Search for 10-K variants 10-K, 10-KSB and 10-K405; we take out the Non-Timely reports
-    qtr_df = qtr_df[qtr_df['Form Type'].str.contains("^10-K$|10-K405$|10-KSB$")]
-    qtr_df['TXT'] = edgar_archive_uri + qtr_df['TXT'].astype(str)
-    edgar_df = pd.concat([edgar_df, qtr_df])
-    number_of_rows += qtr_df.shape[0]
+# Exact form types: 10-K, 10-KSB and 10-K405; we take out the Non-Timely reports (NT 10-K...) and amendments (10-K/A...)
+form_types = {'10-K', '10-K405', '10-KSB'}
+form_type_dtype = pd.CategoricalDtype(sorted(form_types))
+
+# Only a few percent of the filings are 10-K variants: lines without '|10-K' are skipped before parsing
+form_prefix = b'|10-K'
+
+# Types of the parsed columns, also used for a quarter without any 10-K filing so that the concatenation keeps them
+index_dtypes = {'CIK': 'int64', 'Company Name': str, 'Form Type': str, 'Date Filed': str, 'TXT': str}
+
+# Below function reads one quarterly index from the archive and returns the 10-K filings
+# The member is streamed line by line, only the lines with a form type starting with 10-K are kept and handed to the CSV parser, and only the columns we need are parsed
+
+def read_index_member(archive, name):
+    with archive.open(name) as f:
+        lines = [line for line in f if form_prefix in line]
+
+    if len(lines) == 0:
+        qtr_df = pd.DataFrame({column: pd.Series(dtype = dtype) for (column, dtype) in index_dtypes.items()})
+    else:
+        qtr_df = pd.read_csv(io.BytesIO(b''.join(lines)), sep = '|', header = None, names = edgar_columns,
+                             usecols = edgar_columns[:5], dtype = index_dtypes)
+        qtr_df = qtr_df[qtr_df['Form Type'].isin(form_types)]
+    return qtr_df.astype({'Form Type': form_type_dtype})
+
+# All quarters are concatenated once at the end (growing the data frame in the loop copies it every quarter)
+edgar_df = pd.concat([read_index_member(edgar_archive, index) for index in edgar_index], ignore_index = True)
 edgar_archive.close()
 
+edgar_df['TXT'] = edgar_archive_uri + edgar_df['TXT']
+edgar_df['Company Name'] = edgar_df['Company Name'].astype('category')
+number_of_rows = edgar_df.shape[0]
+
 print('Total number of entries in filtered master index: ', number_of_rows)
 
 # Turned out to be very manageable in size (from 2+GB to 20 MB)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+This module reads the 10-K document out of a full-text EDGAR submission without loading the submission into memory. The file is scanned in fixed-size binary chunks for the <DOCUMENT> block of type 10-K; everything before it (and all attachments after it) is skipped as raw bytes, so uuencoded GRAPHIC, ZIP or EXCEL sections are never decoded into strings. Only the 10-K document itself is decoded. Used by download_clean_10k.py, edgar_fetch.py and reclean_10k.py.
+"""
+
+import os
+import re
+
+from text_normalization import clean_markup
+from raw_store import raw_directory, store_submission, open_submission
+from pack_store import decode_text, text_encoding
+
+###############################################################################
+# Same selection as the regular expression '<DOCUMENT>\n<TYPE>10-K[\s\S]*?<\/DOCUMENT>' (case insensitive) on the text of the submission
+# The text was read with universal newlines, so the newline after <DOCUMENT> can be \r\n, \r or \n in the raw bytes
+
+document_start = re.compile(b'<DOCUMENT>(?:\\r\\n?|\\n)<TYPE>10-K', flags=re.I)
+document_end = re.compile(b'</DOCUMENT>', flags=re.I)
+
+# Longest possible start of the 10-K document, a match split over two chunks is found as long as this many bytes are kept
+document_start_max = len(b'<DOCUMENT>\r\n<TYPE>10-K')
+
+chunk_size = 1024*1024
+
+###############################################################################
+# Below function returns the first 10-K document of the submission, from <DOCUMENT> up to and including </DOCUMENT>
+# The submission is read from f (a binary file object, e.g. a file on disk or a decompressed blob of the raw store, see raw_store.py)
+# Peak memory is the size of the 10-K document (plus one chunk), no matter how large the submission is
+# Raises ValueError if the submission does not contain a complete 10-K document
+
+def read_10k_stream(f, name, chunk_size=chunk_size):
+    # Skip everything up to the start of the 10-K document, only the last few bytes are kept between chunks
+    buffer = b''
+    while True:
+        chunk = f.read(chunk_size)
+        buffer += chunk
+        start_match = document_start.search(buffer)
+        if start_match is not None:
+            break
+        if not chunk:
+            raise ValueError('No 10-K document in {0}'.format(name))
+        buffer = buffer[-(document_start_max-1):]
+
+    # Collect the 10-K document up to the first closing tag
+    document = bytearray(buffer[start_match.start():])
+    search_start = start_match.end() - start_match.start()
+    while True:
+        end_match = document_end.search(document, search_start)
+        if end_match is not None:
+            return bytes(document[:end_match.end()])
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError('Incomplete 10-K document in {0}'.format(name))
+        # A closing tag split over two chunks starts at most len('</DOCUMENT>')-1 bytes before the end
+        search_start = max(search_start, len(document) - len(b'</DOCUMENT>') + 1)
+        document += chunk
+
+# Below function tells whether a file in the download directory is a cleaned 10-K document and not a (partly) downloaded submission
+# A submission starts with its SEC header (after the privacy-enhanced message header of older filings), the clean up removes all tags
+# An empty file is not trusted either; only the first bytes are read
+
+submission_head = re.compile(b'<SEC-DOCUMENT>|<SEC-HEADER>|<DOCUMENT>|-----BEGIN PRIVACY-ENHANCED MESSAGE-----', flags=re.I)
+submission_head_size = 8192
+
+def is_cleaned_document(path):
+    with open(path, 'rb') as f:
+        head = f.read(submission_head_size)
+    return len(head) > 0 and submission_head.search(head) is None
+
+def read_10k_bytes(path, chunk_size=chunk_size):
+    with open(path, 'rb') as f:
+        return read_10k_stream(f, path, chunk_size)
+
+# The 10-K document is decoded with universal newlines like every other text (see decode_text in pack_store.py), with a fallback for filings that are not UTF-8
+# An explicit encoding is used as it is
+
+def decode_10k(document, encoding=None):
+    if encoding is None:
+        return decode_text(document)
+    data = document.decode(encoding)
+    return data.replace('\r\n', '\n').replace('\r', '\n')
+
+def read_10k_document(path, encoding=None, chunk_size=chunk_size):
+    return decode_10k(read_10k_bytes(path, chunk_size), encoding)
+
+###############################################################################
+# Below function replaces the downloaded submission by its cleaned 10-K document
+# Aim is to reduce file size drastically here (10-K reports can easily be tens to hundreds of MB in size)
+# We bring that down to about 1 MB and that contains the textual information of the 10-K
+# With raw (a binary file object of the submission) the submission is read from there and path is only written
+
+def clean_submission(path, encoding=None, raw=None):
+    if raw is None:
+        data = read_10k_document(path, encoding)
+    else:
+        data = decode_10k(read_10k_stream(raw, path), encoding)
+    # Refer to extract_mda.py for reasons behind the clean up (see text_normalization.py)
+    data = clean_markup(data)
+    # Written to a temporary file first and renamed, a crash never leaves a half-written filing behind
+    # The cleaned document is written in the encoding the readers try first
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding = encoding or text_encoding) as f:
+        f.write(data)
+    os.replace(temporary_path, path)
+
+###############################################################################
+# The raw submission goes into the raw store (see raw_store.py) under its accession number before it is overwritten by the clean up
+
+def store_clean_submission(path, accession, directory=raw_directory):
+    store_submission(path, accession, directory)
+    clean_submission(path)
+
+# Cleans the stored raw submission of the accession number into path, nothing is downloaded
+
+def clean_stored_submission(path, accession, directory=raw_directory):
+    raw = open_submission(accession, directory)
+    if raw is None:
+        raise ValueError('No raw submission for {0} in {1}'.format(accession, directory))
+    with raw:
+        clean_submission(path, raw = raw)
@@ -3,14 +3,19 @@
 Version 1.0 dated 12-Apr-2014
 
 @author: Kim Criel and Taeyoung Park
+
+Parallel version of extract_mda.py. The filings are extracted by a pool of worker processes (by default one per CPU core, see --workers); every task only holds the paths of one filing and the results are sent back to the parent process, which writes the log files. Run python extract_mda_parallel.py --help for the options.
 """
 
-import pandas as pd
-import re
+import argparse
 import os
 from tqdm import tqdm
-import multiprocessing
-import numpy as np
+
+from mda_extraction import extract_mda_section, extract_mda_file, extract_mda_buffer, is_timeout
+from work_scheduler import run_scheduled, worker_report
+from shard import parse_shard, select_shard, shard_suffix, write_manifest
+from pack_store import PackWriter, is_packed, pack_reader, open_document, document_exists, document_size
+from master_index import load_master_index
 
 ###############################################################################
 # We are taking the output of the download_clean_10k script.
@@ -18,7 +23,7 @@ import numpy as np
 # That's why we need to repeat the clean up regular expressions
 
 download_directory = './edgar_download/'
-output_directory = './mda_extract_test/'
+output_directory = './mda_extract/'
 log_directory = './logs/'
 master_index_df = 'master_index/master_index_filtered.csv'
 extract_error_file = 'extract_error.log'
@@ -26,345 +31,138 @@ extract_stats_file = 'extract_stats.log'
 
 debug = False
 
+# Memory-mapped mode (--mmap): item 7 and item 8 are located on the bytes of the filing and only the MD&A section is decoded (see mda_extraction.py)
+# Line ends (\r\n, \r, \n) and the word Item split over two lines are handled as in the text mode, the sections can still differ from the text mode because:
+# - the text mode cleans up the filing again, which turns its line breaks into spaces, so its lines of the table of contents only end at former tags;
+#   the memory-mapped mode skips the lines of the table of contents as they are on disk
+# - the lookback and the 40 characters searched for discussion and financial are counted in bytes of the filing and not in characters of the cleaned up text
+use_mmap = False
+
 # Files below this size typically do not contain MD&A information
 size_threshold = 3*1024
 
-# Create output file path
-if not os.path.exists(output_directory):
-    os.makedirs(output_directory)
-
-###############################################################################
-# Once again we are reading the master index and adding the relative paths to the files
-
-master_index_df = pd.read_csv(master_index_df, sep = ',')
-master_index_df['File'] = master_index_df['TXT'].str.split('/', expand = True)[6] + '/' + master_index_df['TXT'].str.split('/', expand = True)[7]
-
 ###############################################################################
-# We will define three variants for processing to optimize the number of extracted MD&A sections
-
-def mda_extract(data):
-    # The lookback serves one purpose: eliminate item 7 references, that way we can identify the right start of item 7
-    # List was made based on extracting all item 7 references and compiling that into one list
-    # If an item in the report gets referenced, then typically you well find one of the following words just before
-    lookback = [" Part II", " found ", " see ", " refer to ", " included in "," contained in ", " set forth ", " under ",
-            " market risk", " Data ", " end of this ", " in ", " Note "]
-    lookback = [word.lower() for word in lookback]
-
-    lookback_max = len(max(lookback, key=len))+1
-
-    # Remove all kinds of attachments except the core 10-K or 10-K405
-    data = re.sub('<TYPE>(?!10-K|10-K405)[\S\s]*<\/TEXT>', '', data)
-    # Remove HTML tags and pre-processing (second time as we had leftovers following the download for <0.1% of the dataset)
-    data = re.sub('\n', ' ', data)
-    data = re.sub('>', '>\n', data)
-    # Remove newlines within HTML tags
-    data = re.sub('<.*?>','', data)
-    # Remove non-breaking spaces (HTML leftovers)
-    data = re.sub('&nbsp;', ' ', data)
-    # Replace double spaces
-    data = re.sub(' {2,}', ' ', data)
-    # Remove all HTML entities: https://developer.mozilla.org/en-US/docs/Glossary/Entity
-    # and https://stackoverflow.com/questions/26127775/remove-html-entities-and-extract-text-content-using-regex
-    data = re.sub('/&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});','', data)
-    # Clean up signatures
-    data = re.sub('\/s\/\s|\/s\/','', data)
-    # Final cleaning (keep words with slashes, ampersands and dashes)
-    data = re.sub('[^0-9a-zA-Z][\s\t]+?&-\/\'', '', data)
-    # Clean up previous line
-    data = re.sub('&#\d*;','', data)
-    data = re.sub('\n\s*\n','\n', data)
-    data = re.sub('\r', '\n', data)
-
-    data = re.sub('Ite[m\s:]*\d\.*[\S ]*\.+"*\n', '', data, flags=re.I)
-
-    find_items = re.findall('Ite[m\s\n]*7[^A(]|Ite[m\s\n]*8', data, flags=re.I)
-    find_indices = [m.start() for m in re.finditer('Ite[m\s\n]*7[^A(]|Ite[m\s\n]*8', data, flags=re.I)]
-
-    item_matches = []
-    new_find_items = []
-    new_find_indices = []
-
-    for index in range(len(find_items)):
-        if not any(word in data[find_indices[index]-lookback_max:find_indices[index]].lower() for word in lookback):
-            new_find_items.append(find_items[index])
-            new_find_indices.append(find_indices[index])
-
-    for index in range(len(new_find_items)-1):
-        if '7' in new_find_items[index] and '8' in new_find_items[index+1]:
-            range7 = new_find_indices[index] # 30 characters allows to look for the word discussion
-            range8 = new_find_indices[index+1] # 30 characters allows to look for the word financial
-            if 'discussion' in data[range7:range7+40].lower() and 'financial' in data[range8:range8+40].lower():
-                item_matches.append((new_find_indices[index],new_find_indices[index+1]))
-    new_item_matches = []
-
-    if len(item_matches) > 1:
-        new_item_matches.append(max(item_matches,key=lambda item:item[1]-item[0]))
-        data = data[new_item_matches[0][0] : new_item_matches[0][1]]
-        # statsf.write('Multiple match ' + str(row['File']) + ':' + str(new_item_matches[0]) + 'len' + str(len(item_matches)) + '\n')
-
-    elif len(item_matches) == 0:
-        data = ''
-        # statsf.write('Empty match ' + str(row['File']) + '\n')
-
-        if debug == True:
-            # print(row['File'])
-            print(find_items)
-            print(find_indices)
-            print(new_find_items)
-            print(new_find_indices)
-            # print(item_matches)
-    else:
-        new_item_matches.append(item_matches[0])
-        data = data[new_item_matches[0][0] : new_item_matches[0][1]]
-        # statsf.write('Single match ' + str(row['File']) + ':' + str(new_item_matches[0]) + '\n')
-
-    # As we are looking for textual changes, we are going to remove all numbers
-    data = re.sub('\d','', data)
-    # Final replacement of double spaces
-    data = re.sub(' {2,}', ' ', data)
-
-    # Finally we prepare the output for sentiment analysis based on the Loughran McDonaldMaster Dictionary
-    # by removing parens and possessives as well as leftovers from Item 7A
-    # https://drive.google.com/file/d/0B4niqV00F3msQ3lVeGpKSEg4QUU/view
-
-    data = re.sub("'s|'|\(|\)", '', data)
-    data = re.sub('\n\.', '', data)
-    data = re.sub('[%|$|+|-]\n', '', data)
-    data = re.sub('[+|-]\.\n', '', data)
-    data = re.sub('\n\n', '', data)
-
-    return data
-
-def mda_extract_without_in(data):
-    lookback = [" Part II", " found ", " see ", " refer to ", " included in "," contained in ", " set forth ", " under ",
-            " market risk", " Data ", " end of this ", " Note "]
-    lookback = [word.lower() for word in lookback]
-
-    lookback_max = len(max(lookback, key=len))+1
-
-    data = re.sub('<TYPE>(?!10-K|10-K405)[\S\s]*<\/TEXT>', '', data)
-    data = re.sub('\n', ' ', data)
-    data = re.sub('>', '>\n', data)
-    data = re.sub('<.*?>','', data)
-    data = re.sub('&nbsp;', ' ', data)
-    data = re.sub(' {2,}', ' ', data)
-    data = re.sub('/&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});','', data)
-    data = re.sub('\/s\/\s|\/s\/','', data)
-    data = re.sub('[^0-9a-zA-Z][\s\t]+?&-\/\'', '', data)
-    data = re.sub('&#\d*;','', data)
-    data = re.sub('\n\s*\n','\n', data)
-    data = re.sub('\r', '\n', data)
-
-    data = re.sub('Ite[m\s:]*\d\.*[\S ]*\.+"*\n', '', data, flags=re.I)
-
-    find_items = re.findall('Ite[m\s\n]*7[^A(]|Ite[m\s\n]*8', data, flags=re.I)
-    find_indices = [m.start() for m in re.finditer('Ite[m\s\n]*7[^A(]|Ite[m\s\n]*8', data, flags=re.I)]
-
-    item_matches = []
-    new_find_items = []
-    new_find_indices = []
-
-    for index in range(len(find_items)):
-        if not any(word in data[find_indices[index]-lookback_max:find_indices[index]].lower() for word in lookback):
-            new_find_items.append(find_items[index])
-            new_find_indices.append(find_indices[index])
-
-    for index in range(len(new_find_items)-1):
-        if '7' in new_find_items[index] and '8' in new_find_items[index+1]:
-            range7 = new_find_indices[index]
-            range8 = new_find_indices[index+1]
-            if 'discussion' in data[range7:range7+40].lower() and 'financial' in data[range8:range8+40].lower():
-                item_matches.append((new_find_indices[index],new_find_indices[index+1]))
-    new_item_matches = []
-
-    if len(item_matches) > 1:
-        new_item_matches.append(max(item_matches,key=lambda item:item[1]-item[0]))
-        data = data[new_item_matches[0][0] : new_item_matches[0][1]]
-        # statsf.write('Multiple match ' + str(row['File']) + ':' + str(new_item_matches[0]) + 'len' + str(len(item_matches)) + '\n')
-
-    elif len(item_matches) == 0:
-        data = ''
-        # statsf.write('Empty match ' + str(row['File']) + '\n')
-
-        if debug == True:
-            # print(row['File'])
-            print(find_items)
-            print(find_indices)
-            print(new_find_items)
-            print(new_find_indices)
-    else:
-        new_item_matches.append(item_matches[0])
-        data = data[new_item_matches[0][0] : new_item_matches[0][1]]
-        # statsf.write('Single match ' + str(row['File']) + ':' + str(new_item_matches[0]) + '\n')
-
-    data = re.sub('\d','', data)
-    data = re.sub(' {2,}', ' ', data)
-    data = re.sub("'s|'|\(|\)", '', data)
-    data = re.sub('\n\.', '', data)
-    data = re.sub('[%|$|+|-]\n', '', data)
-    data = re.sub('[+|-]\.\n', '', data)
-    data = re.sub('\n\n', '', data)
-
-    return data
-
-def mda_extract_regex_change(data):
-    # Actually we're not using lookback here, below word does not exist, code to be cleaned up
-    # Difference is at the start with additional regular expressions as well as a five word lookback before the word Item
-    # This serves on eliminating references to items
-    lookback = [' Kabelsalat ']
-    lookback = [word.lower() for word in lookback]
-    lookback_max = len(max(lookback, key=len))+1
-
-    data = re.sub('\r', '', data )
-    data = re.sub('I\r\ntem', 'Item', data, flags=re.I)
-    data = re.sub('It\r\nem', 'Item', data, flags=re.I)
-    data = re.sub('Ite\r\nm', 'Item', data, flags=re.I)
-
-    data = re.sub('I\ntem', 'Item', data, flags=re.I)
-    data = re.sub('It\nem', 'Item', data, flags=re.I)
-    data = re.sub('Ite\nm', 'Item', data, flags=re.I)
-
-    data = re.sub('<TYPE>(?!10-K|10-K405)[\S\s]*<\/TEXT>', '', data)
-    data = re.sub('\n', ' ', data)
-    data = re.sub('>', '>\n', data)
-    data = re.sub('<.*?>','', data)
-    data = re.sub('&nbsp;', ' ', data)
-    data = re.sub(' {2,}', ' ', data)
-    data = re.sub('/&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});','', data)
-    data = re.sub('\/s\/\s|\/s\/','', data)
-    data = re.sub('[^0-9a-zA-Z][\s\t]+?&-\/\'', '', data)
-    data = re.sub('&#\d*;','', data)
-    data = re.sub('\n\s*\n','\n', data)
-    data = re.sub('\r', '\n', data)
-
-    data = re.sub('([a-zA-Z\"\'-]+ +){5}Ite[m\s:]*\d', r'\1', data, flags=re.I)
-
-    find_items = re.findall('Ite[m\s\n]*7[^A(]|Ite[m\s\n]*8', data, flags=re.I)
-    find_indices = [m.start() for m in re.finditer('Ite[m\s\n]*7[^A(]|Ite[m\s\n]*8', data, flags=re.I)]
-
-    item_matches = []
-    new_find_items = []
-    new_find_indices = []
-
-    for index in range(len(find_items)):
-        if not any(word in data[find_indices[index]-lookback_max:find_indices[index]].lower() for word in lookback):
-            new_find_items.append(find_items[index])
-            new_find_indices.append(find_indices[index])
-
-    for index in range(len(new_find_items)-1):
-        if '7' in new_find_items[index] and '8' in new_find_items[index+1]:
-            range7 = new_find_indices[index]
-            range8 = new_find_indices[index+1]
-            if 'discussion' in data[range7:range7+40].lower() and 'financial' in data[range8:range8+40].lower():
-                item_matches.append((new_find_indices[index],new_find_indices[index+1]))
-    new_item_matches = []
-
-    if len(item_matches) > 1:
-        new_item_matches.append(max(item_matches,key=lambda item:item[1]-item[0]))
-        data = data[new_item_matches[0][0] : new_item_matches[0][1]]
-        # statsf.write('Multiple match ' + str(row['File']) + ':' + str(new_item_matches[0]) + 'len' + str(len(item_matches)) + '\n')
-
-    elif len(item_matches) == 0:
-        data = ''
-        # statsf.write('Empty match ' + str(row['File']) + '\n')
-
-        if debug == True:
-            # print(row['File'])
-            print(find_items)
-            print(find_indices)
-            print(new_find_items)
-            print(new_find_indices)
-    else:
-        new_item_matches.append(item_matches[0])
-        data = data[new_item_matches[0][0] : new_item_matches[0][1]]
-        # statsf.write('Single match ' + str(row['File']) + ':' + str(new_item_matches[0]) + '\n')
-
-    data = re.sub('\d','', data)
-    data = re.sub(' {2,}', ' ', data)
-    data = re.sub("'s|'|\(|\)", '', data)
-    data = re.sub('\n\.', '', data)
-    data = re.sub('[%|$|+|-]\n', '', data)
-    data = re.sub('[+|-]\.\n', '', data)
-    data = re.sub('\n\n', '', data)
-    return data
+# Text mode: the filing is read and decoded as a whole
+
+def extract_text(input_dir, file):
+    # Instead of running line by line, we'll take the entire file (as the input comes from a pdf)
+    # https://stackoverflow.com/questions/454456/how-do-i-re-search-or-re-match-on-a-whole-file-without-reading-it-all-into-memor
+    # https://docs.python.org/3/library/mmap.html
+    # Small note on the encoding, there were parsing errors and had to revert to mbcs (multi-byte character set) as we had charmap decode errors
+    # See https://stackoverflow.com/questions/53954988/python-unicodedecodeerror-charmap-codec-cant-decode-byte-0x9d-in-position
+    with open_document(input_dir, file) as f:
+        data = f.read()
+
+    # The variants are tried one after the other until the MD&A section is large enough (see mda_extraction.py)
+    return extract_mda_section(data, file, size_threshold, debug)
+
+# A loose filing is mapped, a packed one is decompressed into bytes (still without decoding the full filing)
+
+def extract_mapped(input_dir, file):
+    reader = pack_reader(input_dir)
+    if reader is None:
+        return extract_mda_file(input_dir + file, file, size_threshold, debug)
+    return extract_mda_buffer(reader.read(file), file, size_threshold, debug)
+
+# Below function extracts the MD&A section of one filing, it runs in the worker processes (see work_scheduler.py)
+# The task only holds the file and its input and output directories, so that the worker processes do not depend on the settings of the parent
+# Returns the match status of the variants, the parent process writes the log files
+# With packed output (see pack_store.py) the extract is returned as well and written by the parent, a pack has only one writer
+
+def extract_file(task):
+    file, input_dir, output_dir, packed_output, mapped = task
+    try:
+        if mapped:
+            data, status_list = extract_mapped(input_dir, file)
+        else:
+            data, status_list = extract_text(input_dir, file)
+
+        if packed_output:
+            return file, status_list, None, data
+
+        # Write the extract Management Discussion part into a new file
+        # Several processes can create the same CIK subdirectory at the same time
+        # The extract is renamed once complete, an interrupted worker never leaves a partial extract that would be skipped as existing
+        output_path = output_dir + file
+        os.makedirs(os.path.dirname(output_path), exist_ok = True)
+        with open(output_path + '.tmp', 'w') as outf:
+            outf.write(data)
+        os.replace(output_path + '.tmp', output_path)
+    except Exception as e:
+        return file, [], 'Failed to extract {0}: {1}'.format(file, str(e)), None
+    return file, status_list, None, None
 
 ###############################################################################
-# Below function allows to run to multiple processes in parallel
-
-def extract_main(df, chunk, chunk_total):
-    
-    cik_list = list(np.squeeze(df['CIK'].unique()))
-    
-    range_len = int(round(len(cik_list) / int(chunk_total), 0))
-
-    range_start = (chunk-1) * range_len
-    
-    if chunk == chunk_total:
-        cik_selection = cik_list[range_start:len(cik_list)]
-    else:
-        cik_selection = cik_list[range_start:range_start+range_len]
+# The filings are handed out to the processes in small batches on demand, balanced by file size (see work_scheduler.py)
 
-    loop_df = df[df['CIK'].isin(cik_selection)]
-    
-    with tqdm(total=loop_df.shape[0]) as pbar:
-        for index, row in loop_df.iterrows():
-            pbar.update(1)
-    
-            # Create subdirectory to store the results for each CIK
-            if os.path.isfile(output_directory  + row['File']):
-                errorf.write('File exists: {0}\n'.format(str(row['File'])))
-            #else:
-            elif os.path.isfile(download_directory  + row['File']):
-                # print(row['File'])
-    
-                # Instead of running line by line, we'll take the entire file (as the input comes from a pdf)
-                # https://stackoverflow.com/questions/454456/how-do-i-re-search-or-re-match-on-a-whole-file-without-reading-it-all-into-memor
-                # https://docs.python.org/3/library/mmap.html
-                # Small note on the encoding, there were parsing errors and had to revert to mbcs (multi-byte character set) as we had charmap decode errors
-                # See https://stackoverflow.com/questions/53954988/python-unicodedecodeerror-charmap-codec-cant-decode-byte-0x9d-in-position
-    
-                with open(download_directory + row['File'], 'r+', encoding = 'mbcs') as f:
-                    if not os.path.exists(output_directory + str(row['CIK'])):
-                        os.makedirs(output_directory + str(row['CIK']))
-    
-                    data = f.read()
-    
-                    data_mda = mda_extract(data)
-                    if len(data_mda) >= size_threshold:
-                        data = data_mda
-                    else:
-                        data_mda_regex = mda_extract_regex_change(data)
-                        if len(data_mda_regex) >= size_threshold:
-                            data = data_mda_regex
-                        else:
-                            data_mda_without_in = mda_extract_without_in(data)
-                            if len(data_mda_without_in) >= size_threshold:
-                                data = data_mda_without_in
-                            else:
-                                data = data_mda
-    
-                    # Write the extract Management Discussion part into a new file
-                    outf = open(output_directory  + row['File'], 'w')
-                    outf.write(data)
-                    outf.close()
-                    f.close()
-                    
-# Verify existence of log directory and create if not exists
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
-errorf = open(log_directory + extract_error_file, 'w')
-# statsf = open(log_directory + extract_stats_file, 'w')
+# With --shard i/N only the companies of shard i are extracted (see shard.py) and a manifest of the extracted files is written
 
 if __name__ == '__main__':
-    concurrent_processes = 6
-    processes = []
-    for index in range(concurrent_processes):
-        process = multiprocessing.Process(target=extract_main, args=(master_index_df, index+1, concurrent_processes,))
-        processes.append(process)
-        process.start()
+    parser = argparse.ArgumentParser(description = 'Extract the MD&A sections of the downloaded filings')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'number of worker processes (default: number of CPU cores)')
+    parser.add_argument('--index', default = master_index_df, help = 'filtered master index (CSV)')
+    parser.add_argument('--input', default = download_directory, help = 'directory with the downloaded filings')
+    parser.add_argument('--output', default = output_directory, help = 'directory for the MD&A extracts')
+    parser.add_argument('--shard', type = parse_shard, default = None, help = 'only extract shard i of N, e.g. 2/5')
+    parser.add_argument('--pack', action = 'store_true', help = 'write the extracts into packs (see pack_store.py)')
+    parser.add_argument('--mmap', action = 'store_true', default = use_mmap, help = 'locate the MD&A section on the memory-mapped filing, only decode the section (the section can differ slightly from the text mode)')
+    args = parser.parse_args()
+    input_dir = os.path.join(args.input, '')
+    output_dir = os.path.join(args.output, '')
+
+    # Once again we are reading the master index and adding the relative paths to the files
+    master_index_df = load_master_index(args.index)
+
+    # Verify existence of output and log directory and create if not exists
+    for directory in [output_dir, log_directory]:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    errorf = open(log_directory + extract_error_file.replace('.log', shard_suffix(args.shard) + '.log'), 'w')
+    statsf = open(log_directory + extract_stats_file.replace('.log', shard_suffix(args.shard) + '.log'), 'w')
+
+    # Input and output can be directories of loose files or packed directories (see pack_store.py)
+    packed_output = args.pack or is_packed(output_dir)
+    writer = PackWriter(output_dir) if packed_output else None
+
+    # The file size is the estimate of the work per filing
+    tasks = []
+    sizes = []
+    completed_files = []
+    shard_df = select_shard(master_index_df, args.shard)
+    file_year = dict(zip(shard_df['File'], shard_df['Year']))
+    for file in shard_df['File']:
+        if document_exists(output_dir, file):
+            errorf.write('File exists: {0}\n'.format(str(file)))
+            completed_files.append(file)
+        elif document_exists(input_dir, file):
+            tasks.append((file, input_dir, output_dir, packed_output, args.mmap))
+            sizes.append(document_size(input_dir, file))
+
+    worker_stats = {}
+    with tqdm(total=len(tasks)) as pbar:
+        for results in run_scheduled(extract_file, tasks, sizes, args.workers, worker_stats):
+            pbar.update(len(results))
+            for file, status_list, error, data in results:
+                for status in status_list:
+                    statsf.write(status + '\n')
+                    if is_timeout(status):
+                        errorf.write(status + '\n')
+                if error is not None:
+                    errorf.write(error + '\n')
+                else:
+                    if data is not None:
+                        writer.write_text(file, data, file_year[file])
+                    completed_files.append(file)
+
+    if writer is not None:
+        writer.close()
+
+    for line in worker_report(worker_stats):
+        print(line)
+
+    if args.shard is not None:
+        write_manifest(output_dir, args.shard, completed_files)
 
-    for process in processes:
-        process.join()
-    
     errorf.close()
-    # statsf.close()
\ No newline at end of file
+    statsf.close()
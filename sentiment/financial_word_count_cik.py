@@ -7,12 +7,12 @@ Version 1.0 dated 13-Apr-2020
 This script computes the word count per Central Index Key in a JSON format for visualization.
 """
 
-import pandas as pd
 import os
 from tqdm import tqdm
-import json
-import csv
-import re
+
+from master_index import load_master_index, iter_groups
+from pack_store import open_document
+from results_io import ResultsWriter
 
 ###############################################################################
 # We are taking the output of the download_clean_10k script.
@@ -48,35 +48,18 @@ def stemmer(data, enabled):
 
 stemmer_enabled = False
 
-###############################################################################
-# Function to read in csv files for the sentiment dictionaries
-
-def dict_csv_reader(dict_file):
-    output = []
-    with open(dict_file, newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            output.append(row[0])
-        return output
-
 ###############################################################################
 # Import sentiment dictionaries based no Loughran & McDonald
+# The dictionaries are loaded once into sets (see lexicon.py) to avoid a linear scan per word
 
-stop_words_csv = 'stop_words.csv'
-positive_words_csv = 'positive_words.csv'
-negative_words_csv = 'negative_words.csv'
-litigious_words_csv  = 'litigious_words.csv'
+from lexicon import load_lexicon, tokenize, financial_word_counts
 
-stop_words = dict_csv_reader(dictionary_directory + stop_words_csv)
-positive_words = dict_csv_reader(dictionary_directory + positive_words_csv)
-negative_words = dict_csv_reader(dictionary_directory + negative_words_csv)
-litigious_words  = dict_csv_reader(dictionary_directory + litigious_words_csv)
+lexicon = load_lexicon(dictionary_directory)
 
 ###############################################################################
 # Once again we are reading the master index and adding the relative paths to the files
 
-master_index_df = pd.read_csv(master_index_df, sep = ',')
-master_index_df['File'] = master_index_df['TXT'].str.split('/', expand = True)[6] + '/' + master_index_df['TXT'].str.split('/', expand = True)[7]
+master_index_df = load_master_index(master_index_df)
 
 ###############################################################################
 # In below code we are calculating the relative proportional difference based on the dictionaries of Loughran & McDonald
@@ -95,45 +78,36 @@ cik_df = master_index_df['CIK'].unique()
 # We found that below 2 KB we have this behaviour consistently
 mda_size_threshold = 2048
 
-# Consolidate the three word lists
-consolidated_words = positive_words + negative_words + litigious_words
-word_count_results_dict = {}
+# Verify existence of output directory and create if not exists
+if not os.path.exists(output_directory):
+    os.makedirs(output_directory)
+
+# The results are written per CIK as soon as they are complete (see results_io.py), the JSON file is written from them at the end
+results_writer = ResultsWriter(output_directory + word_count_json_file)
 
 # Include progress bar (tqdm library)
 with tqdm(total=len(cik_df)) as pbar:
-    for cik in cik_df:
+    for cik, loop_df in iter_groups(master_index_df, 'cik'):
         pbar.update(1)
-        loop_df = master_index_df[master_index_df['CIK'] == cik].sort_values(by=['Date Filed'], ascending=True)
 
         word_count_dict = {}
 
         for index, row in loop_df.iterrows():
             try:
-                with open(input_directory + row['File'], 'r+', encoding = 'mbcs') as f:
+                with open_document(input_directory, row['File']) as f:
                     data = f.read().lower()
 
-                    data_without_stop_words  = [word for word in re.split("\W+", data) if word not in stop_words and len(word) > 1]
+                    data_without_stop_words = tokenize(data, lexicon)
 
-                    for word in data_without_stop_words:
-                        if word in consolidated_words:
-                            if word_count_dict.get(word) != None:
-                                word_count_dict[word] += 1
-                            else:
-                                word_count_dict[word] = 1
+                    financial_word_counts(data_without_stop_words, lexicon, word_count_dict)
             except Exception as e:
                 print(e)
 
-        word_count_results_dict[str(cik)] = word_count_dict
+        results_writer.write(str(cik), word_count_dict)
 
         for k, v in word_count_dict.items():
             statsf.write(str(cik) + ',' + str(k) + ',' + str(v) +'\n')
 
-# Verify existence of output directory and create if not exists
-if not os.path.exists(output_directory):
-    os.makedirs(output_directory)
-
-with open(output_directory + word_count_json_file, 'w') as f:
-    json.dump(word_count_results_dict, f)
-    f.close()
+results_writer.close()
 
 statsf.close()
\ No newline at end of file
@@ -7,15 +7,17 @@ Version 1.0 dated 13-Apr-2020
 This script computes the full word count per Central Index Key in a JSON format for visualization.
 """
 
-import pandas as pd
 import os
 from tqdm import tqdm
-import json
 import csv
 import re
 from sklearn.feature_extraction.text import CountVectorizer
 import numpy as np
 
+from master_index import load_master_index, iter_groups
+from pack_store import open_document
+from results_io import ResultsWriter
+
 ###############################################################################
 # We are taking the output of the download_clean_10k script.
 
@@ -77,8 +79,7 @@ litigious_words  = dict_csv_reader(dictionary_directory + litigious_words_csv)
 ###############################################################################
 # Once again we are reading the master index and adding the relative paths to the files
 
-master_index_df = pd.read_csv(master_index_df, sep = ',')
-master_index_df['File'] = master_index_df['TXT'].str.split('/', expand = True)[6] + '/' + master_index_df['TXT'].str.split('/', expand = True)[7]
+master_index_df = load_master_index(master_index_df)
 
 ###############################################################################
 # In below code we are calculating the relative proportional difference based on the dictionaries of Loughran & McDonald
@@ -99,19 +100,24 @@ mda_size_threshold = 2048
 
 # Consolidate the three word lists
 consolidated_words = positive_words + negative_words + litigious_words
-word_count_results_dict = {}
+
+# Verify existence of output directory and create if not exists
+if not os.path.exists(output_directory):
+    os.makedirs(output_directory)
+
+# The results are written per CIK as soon as they are complete (see results_io.py), the JSON file is written from them at the end
+results_writer = ResultsWriter(output_directory + word_count_json_file)
 
 # Include progress bar (tqdm library)
 with tqdm(total=len(cik_df)) as pbar:
-    for cik in cik_df:
+    for cik, loop_df in iter_groups(master_index_df, 'cik'):
         pbar.update(1)
-        loop_df = master_index_df[master_index_df['CIK'] == cik].sort_values(by=['Date Filed'], ascending=True)
 
         corpus = []
 
         for index, row in loop_df.iterrows():
             try:
-                with open(input_directory + row['File'], 'r+', encoding = 'mbcs') as f:
+                with open_document(input_directory, row['File']) as f:
                     data = f.read().lower()
                     # Had some strange results coming from the MD&A formatting, removing underscores explicitly
                     corpus.append(re.sub('_', '', data))
@@ -129,17 +135,13 @@ with tqdm(total=len(cik_df)) as pbar:
             features = vectorizer.get_feature_names()
     
             # Finally we create our dictionaries for flat file and JSON output
-            word_count_results_dict[str(cik)] = {ft:int(cw) for (ft, cw) in zip(features, count_words)}
+            cik_results = {ft:int(cw) for (ft, cw) in zip(features, count_words)}
     
-            for k, v in word_count_results_dict[str(cik)].items():
+            for k, v in cik_results.items():
                 statsf.write(str(cik) + ',' + str(k) + ',' + str(v) +'\n')
 
-# Verify existence of output directory and create if not exists
-if not os.path.exists(output_directory):
-    os.makedirs(output_directory)
+            results_writer.write(str(cik), cik_results)
 
-with open(output_directory + word_count_json_file, 'w') as f:
-    json.dump(word_count_results_dict, f)
-    f.close()
+results_writer.close()
 
 statsf.close()
\ No newline at end of file
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps track of the download and clean up of every filing in a SQLite database (the job ledger). Each filing is pending, downloaded, cleaned or failed, with the number of attempts and the reason of the last failure. The downloaders take their work from the ledger instead of checking the download directory file by file, and a resume run only retries the filings that failed or were left incomplete.
+"""
+
+import sqlite3
+import os
+from datetime import datetime
+
+from edgar_submission import is_cleaned_document
+
+###############################################################################
+ledger_file = 'dl_ledger.sqlite'
+
+# States of a filing
+pending = 'pending'
+downloaded = 'downloaded'
+cleaned = 'cleaned'
+failed = 'failed'
+
+# Filings that failed this many times are not retried anymore
+max_attempts = 5
+
+###############################################################################
+# One row per filing, the file (CIK/accession.txt) is the key
+
+def open_ledger(path=ledger_file):
+    # Several download processes can share the ledger, SQLite locks the database for every write
+    conn = sqlite3.connect(path, timeout = 60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS filings ('
+                 'file TEXT PRIMARY KEY, cik INTEGER, url TEXT, state TEXT NOT NULL, '
+                 'attempts INTEGER NOT NULL DEFAULT 0, reason TEXT, updated TEXT)')
+    conn.execute('CREATE INDEX IF NOT EXISTS filings_state ON filings (state)')
+    conn.commit()
+    return conn
+
+# Below function adds the filings of the master index that are not in the ledger yet
+# Filings downloaded before the ledger existed are recognized by their file in dl_dir, this is the only time the directory is checked
+# Only a file that is a cleaned 10-K document counts as cleaned; a submission left by an interrupted download or clean up is registered as downloaded, a resume run retries it
+
+def register_filings(conn, master_index_df, dl_dir=None):
+    known_files = set(file for (file,) in conn.execute('SELECT file FROM filings'))
+    now = datetime.now().isoformat(timespec = 'seconds')
+    new_rows = []
+    for file, cik, txt in zip(master_index_df['File'], master_index_df['CIK'], master_index_df['TXT']):
+        if file in known_files:
+            continue
+        state = pending
+        if dl_dir is not None and os.path.isfile(dl_dir + file):
+            state = cleaned if is_cleaned_document(dl_dir + file) else downloaded
+        new_rows.append((file, int(cik), txt, state, now))
+        known_files.add(file)
+    with conn:
+        conn.executemany('INSERT INTO filings (file, cik, url, state, updated) VALUES (?, ?, ?, ?, ?)', new_rows)
+    return len(new_rows)
+
+# Filings still to do as (file, CIK, URL), in the order of the master index
+# A normal run only takes the pending filings, a resume run also retries failed and incomplete (downloaded but not cleaned) ones
+
+def filings_to_process(conn, resume=False):
+    if resume:
+        query = ('SELECT file, cik, url FROM filings WHERE state = ? OR state = ? OR (state = ? AND attempts < ?) ORDER BY rowid')
+        return conn.execute(query, (pending, downloaded, failed, max_attempts)).fetchall()
+    return conn.execute('SELECT file, cik, url FROM filings WHERE state = ? ORDER BY rowid', (pending,)).fetchall()
+
+def completed_files(conn):
+    return [file for (file,) in conn.execute('SELECT file FROM filings WHERE state = ? ORDER BY rowid', (cleaned,))]
+
+###############################################################################
+# State changes are committed immediately, a crash never loses more than the filing in progress
+
+def start_attempt(conn, file):
+    with conn:
+        conn.execute('UPDATE filings SET attempts = attempts + 1, updated = ? WHERE file = ?',
+                     (datetime.now().isoformat(timespec = 'seconds'), file))
+
+def set_state(conn, file, state, reason=None):
+    with conn:
+        conn.execute('UPDATE filings SET state = ?, reason = ?, updated = ? WHERE file = ?',
+                     (state, reason, datetime.now().isoformat(timespec = 'seconds'), file))
+
+# Attempt and result in one go, for callers that only learn the outcome once the filing is done (e.g. from a worker process)
+
+def record_attempt(conn, file, state, reason=None):
+    with conn:
+        conn.execute('UPDATE filings SET attempts = attempts + 1, state = ?, reason = ?, updated = ? WHERE file = ?',
+                     (state, reason, datetime.now().isoformat(timespec = 'seconds'), file))
+
+def state_counts(conn):
+    return dict(conn.execute('SELECT state, COUNT(*) FROM filings GROUP BY state').fetchall())
+
+###############################################################################
+# Overview of the ledger, e.g. python job_ledger.py to see how far the download is
+
+if __name__ == '__main__':
+    conn = open_ledger(ledger_file)
+    for state, count in sorted(state_counts(conn).items()):
+        print('{0}: {1}'.format(state, count))
+    for file, attempts, reason in conn.execute('SELECT file, attempts, reason FROM filings WHERE state = ? ORDER BY file', (failed,)):
+        print('Failed {0} ({1} attempts): {2}'.format(file, attempts, reason))
+    conn.close()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+This module loads the Loughran & McDonald dictionaries (stored in master_dictionary/ by master_dictionary.py) once into hashed lookup structures. It is shared by sentiment.py and the financial_word_count_*.py scripts, so each MD&A extract is split and counted in a single pass instead of scanning the word lists for every token.
+"""
+
+import csv
+import re
+from collections import Counter
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+###############################################################################
+dictionary_directory = './master_dictionary/'
+
+stop_words_csv = 'stop_words.csv'
+positive_words_csv = 'positive_words.csv'
+negative_words_csv = 'negative_words.csv'
+litigious_words_csv  = 'litigious_words.csv'
+
+# Same split as the original scripts: runs of non-word characters separate the words
+word_split = re.compile(r'\W+')
+# Equivalent token pattern for CountVectorizer (the non-empty parts of the split above)
+word_pattern = r'(?u)\w+'
+
+###############################################################################
+# Function to read in csv files for the sentiment dictionaries
+
+def dict_csv_reader(dict_file):
+    output = []
+    with open(dict_file, newline='') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            output.append(row[0])
+        return output
+
+###############################################################################
+# Below function returns a dictionary with the word sets as well as a single mapping word -> (positive, negative, litigious)
+# The mapping allows to score all three categories with one hash lookup per distinct word
+
+def load_lexicon(directory=dictionary_directory):
+    stop_words = frozenset(dict_csv_reader(directory + stop_words_csv))
+    positive_words = frozenset(dict_csv_reader(directory + positive_words_csv))
+    negative_words = frozenset(dict_csv_reader(directory + negative_words_csv))
+    litigious_words = frozenset(dict_csv_reader(directory + litigious_words_csv))
+
+    financial_words = positive_words | negative_words | litigious_words
+    categories = {word: (word in positive_words, word in negative_words, word in litigious_words) for word in financial_words}
+
+    return {'stop': stop_words,
+            'positive': positive_words,
+            'negative': negative_words,
+            'litigious': litigious_words,
+            'financial': financial_words,
+            'categories': categories}
+
+###############################################################################
+# Split the (lower case) MD&A extract and drop stop words as well as single characters
+
+def tokenize(data, lexicon):
+    stop_words = lexicon['stop']
+    return [word for word in word_split.split(data) if word not in stop_words and len(word) > 1]
+
+# Returns the positive, negative and litigious counts of a list of words
+# Counter keeps the order of first occurrence, which we rely on for the word count outputs below
+
+def polarity_counts(words, lexicon):
+    categories = lexicon['categories']
+    pos = 0.0
+    neg = 0.0
+    lit = 0.0
+    for word, count in Counter(words).items():
+        flags = categories.get(word)
+        if flags is not None:
+            if flags[0]:
+                pos += count
+            if flags[1]:
+                neg += count
+            if flags[2]:
+                lit += count
+    return pos, neg, lit
+
+# Basic metric Relative Proportional Difference (between -1 and 1)
+
+def polarity_score(pos, neg):
+    if (pos+neg) != 0.0:
+        return round((pos-neg) / (pos+neg), 4)
+    return 0.0
+
+# Adds the counts of the financial words (positive, negative or litigious) to word_count_dict
+# Words are inserted in order of first occurrence, equal to the original word by word loop
+
+def financial_word_counts(words, lexicon, word_count_dict=None):
+    if word_count_dict is None:
+        word_count_dict = {}
+    financial_words = lexicon['financial']
+    for word, count in Counter(words).items():
+        if word in financial_words:
+            word_count_dict[word] = word_count_dict.get(word, 0) + count
+    return word_count_dict
+
+###############################################################################
+# Batch scoring: the whole corpus becomes one sparse document-term matrix restricted to the dictionary words
+# Stop words and single characters never make it into the vocabulary, so the counts equal the ones of tokenize()
+# https://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.CountVectorizer.html
+
+def lexicon_vocabulary(lexicon):
+    stop_words = lexicon['stop']
+    return sorted(word for word in lexicon['financial'] if word not in stop_words and len(word) > 1)
+
+# 0/1 vectors over the vocabulary, one per category
+
+def category_vectors(vocabulary, lexicon):
+    pos_vector = np.array([word in lexicon['positive'] for word in vocabulary], dtype=np.float64)
+    neg_vector = np.array([word in lexicon['negative'] for word in vocabulary], dtype=np.float64)
+    lit_vector = np.array([word in lexicon['litigious'] for word in vocabulary], dtype=np.float64)
+    return pos_vector, neg_vector, lit_vector
+
+# The corpus can be any iterable of (raw) texts, e.g. a generator reading the extracts one by one
+# Returns three arrays with the positive, negative and litigious counts per document
+
+def batch_polarity_counts(corpus, lexicon):
+    vocabulary = lexicon_vocabulary(lexicon)
+    vectorizer = CountVectorizer(vocabulary=vocabulary, token_pattern=word_pattern, lowercase=True)
+    X = vectorizer.transform(corpus)
+    pos_vector, neg_vector, lit_vector = category_vectors(vocabulary, lexicon)
+    return X @ pos_vector, X @ neg_vector, X @ lit_vector
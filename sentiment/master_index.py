@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+This module loads the filtered master index for all scripts. Next to master_index_filtered.csv a columnar copy (master_index_filtered.parquet) is kept with the relative path of the file (File), the CIK as integer, the filing date and the filing year already present, sorted by CIK and filing date so that all filings of one company are next to each other. The columnar copy is read memory-mapped, which takes a fraction of the time of parsing the CSV and splitting the URIs again. It is created from the CSV the first time the index is loaded and again whenever the CSV is newer (python master_index.py converts it right away). Without pyarrow the CSV is used as before.
+"""
+
+import numpy as np
+import pandas as pd
+import os
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+columnar_available = pyarrow is not None
+
+###############################################################################
+index_file = 'master_index/master_index_filtered.csv'
+columnar_extension = '.parquet'
+
+# Sort order per grouping: by CIK (all filings of a company), by filing year, or by CIK and filing year
+# Within a group the filings are always in order of filing date
+group_columns = {'cik': ['CIK'], 'year': ['Year'], 'cik_year': ['CIK', 'Year']}
+sort_columns = {'cik': ['CIK', 'Date Filed'], 'year': ['Year', 'CIK', 'Date Filed'], 'cik_year': ['CIK', 'Date Filed']}
+
+# Relative path of the file in the download and extract directories (CIK/accession.txt), i.e. the 7th and 8th part of the URI
+file_pattern = '^(?:[^/]*/){6}([^/]*/[^/]*)'
+
+###############################################################################
+def columnar_path(path):
+    return os.path.splitext(path)[0] + columnar_extension
+
+# Below function adds File and Year to the master index as read from the CSV and sorts it by CIK and filing date
+# The filing date stays a string (YYYY-MM-DD), it is used as key in the results of the scripts
+
+def prepare_master_index(master_index_df):
+    master_index_df = master_index_df.astype({'CIK': 'int64', 'Date Filed': str})
+    master_index_df['File'] = master_index_df['TXT'].str.extract(file_pattern, expand = False)
+    master_index_df['Year'] = master_index_df['Date Filed'].str[:4].astype('int16')
+    for column in ['Company Name', 'Form Type']:
+        if column in master_index_df.columns:
+            master_index_df[column] = master_index_df[column].astype('category')
+    master_index_df = master_index_df.sort_values(by = ['CIK', 'Date Filed'], kind = 'mergesort')
+    return master_index_df.reset_index(drop = True)
+
+# Written to a temporary file first and renamed, several scripts can start at the same time without reading a half-written index
+
+def write_master_index(master_index_df, path):
+    temporary_path = path + '.{0}.tmp'.format(os.getpid())
+    master_index_df.to_parquet(temporary_path, engine = 'pyarrow', index = False)
+    os.replace(temporary_path, path)
+
+###############################################################################
+# Below function returns the master index with File, CIK, Date Filed and Year, sorted by CIK and filing date
+# The columnar copy is used when it is at least as recent as the CSV, otherwise it is (re)created from the CSV
+
+def load_master_index(path=index_file, columns=None):
+    if not columnar_available:
+        master_index_df = prepare_master_index(pd.read_csv(path, sep = ','))
+        return master_index_df if columns is None else master_index_df[columns]
+
+    parquet_path = columnar_path(path)
+    if path != parquet_path and os.path.isfile(path) and (not os.path.isfile(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(path)):
+        master_index_df = prepare_master_index(pd.read_csv(path, sep = ','))
+        try:
+            write_master_index(master_index_df, parquet_path)
+        except OSError:
+            # A read-only index directory only costs the speed up
+            pass
+        return master_index_df if columns is None else master_index_df[columns]
+
+    return pd.read_parquet(parquet_path, engine = 'pyarrow', columns = columns, memory_map = True)
+
+###############################################################################
+# Grouped iteration over the master index in one pass, instead of selecting the filings of every CIK (or year) with a mask over the whole index
+# The loaded index is already sorted by CIK and filing date, so for 'cik' and 'cik_year' nothing is sorted again
+
+def sort_by_group(master_index_df, by='cik'):
+    columns = sort_columns[by]
+    if pd.MultiIndex.from_frame(master_index_df[columns]).is_monotonic_increasing:
+        return master_index_df
+    return master_index_df.sort_values(by = columns, kind = 'mergesort')
+
+# Position of the first row of every group in the sorted index (plus the number of rows at the end)
+
+def group_bounds(master_index_df, by='cik'):
+    change = np.zeros(master_index_df.shape[0], dtype = bool)
+    change[:1] = True
+    for column in group_columns[by]:
+        values = master_index_df[column].to_numpy()
+        change[1:] |= values[1:] != values[:-1]
+    return np.append(np.flatnonzero(change), master_index_df.shape[0])
+
+# Group number (0, 1, 2, ...) of every row in the sorted index, e.g. for the batch computations on the whole corpus
+
+def group_ids(master_index_df, by='cik'):
+    bounds = group_bounds(master_index_df, by)
+    return np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+
+# Yields (key, filings) per group: the CIK, the year or (CIK, year) as key and the filings in order of filing date
+
+def iter_groups(master_index_df, by='cik'):
+    master_index_df = sort_by_group(master_index_df, by)
+    bounds = group_bounds(master_index_df, by)
+    keys = [master_index_df[column].to_numpy() for column in group_columns[by]]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        key = tuple(int(values[start]) for values in keys)
+        yield key if len(key) > 1 else key[0], master_index_df.iloc[start:end]
+
+def group_count(master_index_df, by='cik'):
+    return master_index_df.drop_duplicates(subset = group_columns[by]).shape[0]
+
+###############################################################################
+# Converts the CSV into the columnar index, e.g. python master_index.py master_index/master_index_filtered.csv
+
+if __name__ == '__main__':
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else index_file
+    if not columnar_available:
+        raise SystemExit('pyarrow is needed for the columnar master index')
+    master_index_df = prepare_master_index(pd.read_csv(path, sep = ','))
+    write_master_index(master_index_df, columnar_path(path))
+    print('Filings in columnar master index: ', master_index_df.shape[0])
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+This script computes all MD&A metrics in one pass over mda_extract/: polarity (sentiment.py), cosine similarity (cosine_similarity.py), financial word counts (financial_word_count_*.py) and full word counts (full_word_count_*.py) per Central Index Key, year and Central Index Key-year. Every extract is read and tokenized once and handed to the metric consumers below, which write the same log and JSON files as the individual scripts in logs/ and results/.
+"""
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+import os
+from tqdm import tqdm
+from collections import Counter
+from functools import partial
+
+from lexicon import load_lexicon, polarity_counts, polarity_score, financial_word_counts
+from corpus_store import tokenize_extract, open_corpus, document_words
+from similarity import pair_similarity, lagged_pairs
+from master_index import load_master_index, iter_groups
+from pack_store import open_document, document_size
+from results_io import ResultsWriter
+
+###############################################################################
+# We are taking the output of the extract_mda script.
+
+input_directory = './mda_extract/'
+output_directory = './results/'
+log_directory = './logs/'
+master_index_df = 'master_index/master_index_filtered.csv'
+dictionary_directory = './master_dictionary/'
+
+# Not all MD&A reports can be extracted corrctly or sometimes refer to obscure page numbering (that afterwards gets lost in the way the original file is stored)
+# We found that below 2 KB we have this behaviour consistently
+mda_size_threshold = 2048
+
+# Metrics to compute, remove an entry to skip the corresponding outputs
+metrics = ['sentiment', 'similarity',
+           'financial_word_count_cik', 'financial_word_count_year', 'financial_word_count_cik_year',
+           'full_word_count_cik', 'full_word_count_year', 'full_word_count_cik_year']
+
+# Read the tokens from the corpus built by corpus_store.py instead of the text files (set to None to read mda_extract/)
+corpus_directory = None
+
+###############################################################################
+# One tokenization serves all metrics: the lower case runs of word characters (see corpus_store.py)
+# - polarity and financial counts split on non-word characters and drop stop words and single characters (see lexicon.py)
+# - TF-IDF keeps the words of two characters or more (default token pattern of the vectorizer)
+# - full word counts remove underscores and keep the words of three characters or more (except stop words)
+
+# Returns None when the extract cannot be read, consumers skip those filings
+
+def read_extract(file):
+    try:
+        with open_document(input_directory, file) as f:
+            data = f.read()
+        size = document_size(input_directory, file)
+    except Exception as e:
+        print(e)
+        return None
+    return {'tokens': tokenize_extract(data), 'empty': data == '', 'size': size}
+
+# Same document from the tokenized corpus, no text decoding involved
+
+def read_corpus_document(corpus, file):
+    if file not in corpus['documents'].index:
+        return None
+    document = corpus['documents'].loc[file]
+    return {'tokens': document_words(corpus, file), 'empty': bool(document['Empty']), 'size': int(document['Size'])}
+
+###############################################################################
+# Results are written the same way as in the individual scripts: one line per entry in the log and one record per CIK (or year) in the JSON file (see results_io.py)
+
+class ResultsOutput:
+
+    def __init__(self, name):
+        self.statsf = open(log_directory + name + '.log', 'w')
+        self.results_writer = ResultsWriter(output_directory + name + '.json')
+
+    def write(self, key, value, log_lines):
+        for line in log_lines:
+            self.statsf.write(','.join(str(x) for x in line) + '\n')
+        self.results_writer.write(key, value)
+
+    def close(self):
+        self.statsf.close()
+        self.results_writer.close()
+
+###############################################################################
+# Metric consumers
+# Each consumer receives the filings of one CIK at a time (sorted by filing date) through consume_cik() and closes its outputs in write()
+# The results of a CIK are written as soon as they are complete, only the counts per year are kept until the end
+
+class PolarityConsumer:
+    name = 'sentiment_stats'
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        self.output = ResultsOutput(self.name)
+
+    def consume_cik(self, cik, rows, documents):
+        cik_results = {}
+        log_lines = []
+        for row, document in zip(rows, documents):
+            if document is None:
+                continue
+            stop_words = self.lexicon['stop']
+            words = [word for word in document['tokens'] if word not in stop_words and len(word) > 1]
+            pos, neg, lit = polarity_counts(words, self.lexicon)
+            sentiment_score = polarity_score(pos, neg)
+            cik_results[row['Date Filed']] = sentiment_score
+            log_lines.append((cik, row['Date Filed'], sentiment_score))
+        self.output.write(str(cik), cik_results, log_lines)
+
+    def write(self):
+        self.output.close()
+
+class SimilarityConsumer:
+    name = 'similarity_stats'
+
+    def __init__(self):
+        self.output = ResultsOutput(self.name)
+
+    def consume_cik(self, cik, rows, documents):
+        tfidf_input = []
+        size_list = []
+        date_list = []
+        for row, document in zip(rows, documents):
+            if document is None:
+                continue
+            if document['empty']:
+                tfidf_input.append(['empty'])
+            else:
+                tfidf_input.append([word for word in document['tokens'] if len(word) > 1])
+            size_list.append(document['size'] < mda_size_threshold)
+            date_list.append(row['Date Filed'])
+
+        if len(tfidf_input) < 2:
+            self.output.write(str(cik), {}, [])
+            return
+
+        # The documents are tokenized already, so the vectorizer only needs to count them
+        tfidf_vectorizer = TfidfVectorizer(analyzer=lambda words: words)
+        tfidf_matrix = tfidf_vectorizer.fit_transform(tfidf_input)
+        first_rows, second_rows = lagged_pairs(np.zeros(len(tfidf_input)), 1)
+        cos_sim_result = [round(x, 4) for x in pair_similarity(tfidf_matrix, first_rows, second_rows)]
+
+        # Same correction as in cosine_similarity.py for extracts below the size threshold
+        cos_sim_corrected_result = [cs if not sz and not szs else 1.0 for (cs, sz, szs) in zip(cos_sim_result, size_list[1:], size_list[:-1])]
+
+        cik_results = {dt:cs for (cs, dt) in zip(cos_sim_corrected_result, date_list[1:])}
+        log_lines = [(cik, dt, cs) for (cs, dt) in zip(cos_sim_corrected_result, date_list[1:])]
+        self.output.write(str(cik), cik_results, log_lines)
+
+    def write(self):
+        self.output.close()
+
+# Word counts are aggregated per CIK, per year or per CIK-year depending on the level
+# The counting function adds the words of one document to a dictionary of counts
+# At the CIK-year level the scripts differ: full_word_count_cik_year.py keeps a running total over the filings of the CIK (every year holds the total up to its last filing)
+# and financial_word_count_cik_year.py keeps the counts of the last filing of the year (empty if it cannot be read)
+
+def count_financial_words(lexicon, document, word_count_dict):
+    stop_words = lexicon['stop']
+    words = [word for word in document['tokens'] if word not in stop_words and len(word) > 1]
+    financial_word_counts(words, lexicon, word_count_dict)
+
+def count_full_words(lexicon, document, word_count_dict):
+    # Had some strange results coming from the MD&A formatting, removing underscores explicitly
+    stop_words = lexicon['stop']
+    words = [word.replace('_', '') for word in document['tokens']]
+    for word, count in Counter(words).items():
+        if len(word) > 2 and word not in stop_words:
+            word_count_dict[word] = word_count_dict.get(word, 0) + count
+
+class WordCountConsumer:
+
+    def __init__(self, name, level, count, cumulative):
+        self.name = name
+        self.level = level
+        self.count = count
+        self.cumulative = cumulative
+        self.output = ResultsOutput(name)
+        self.year_results = {}
+
+    # Counts as they go into the JSON file, None leaves them out
+    def result(self, word_count_dict):
+        return word_count_dict
+
+    # Unreadable extracts count as empty: a CIK or year with only unreadable extracts gets an empty result, as in the scripts
+    def consume_cik(self, cik, rows, documents):
+        if self.level == 'year':
+            for row, document in zip(rows, documents):
+                word_count_dict = self.year_results.setdefault(row['Date Filed'][:4], {})
+                if document is not None:
+                    self.count(document, word_count_dict)
+            return
+
+        if self.level == 'cik':
+            word_count_dict = {}
+            for document in documents:
+                if document is not None:
+                    self.count(document, word_count_dict)
+            word_count_dict = self.result(word_count_dict)
+            if word_count_dict is not None:
+                self.output.write(str(cik), word_count_dict, [(cik, k, v) for k, v in word_count_dict.items()])
+            return
+
+        # Every filing replaces the result of its year, the last filing of a year is the one that stays in the JSON file
+        # The log has the result of every filing
+        cik_results = {}
+        log_lines = []
+        running_dict = {}
+        for row, document in zip(rows, documents):
+            year = row['Date Filed'][:4]
+            if self.cumulative:
+                if document is not None:
+                    self.count(document, running_dict)
+                word_count_dict = dict(running_dict)
+            else:
+                word_count_dict = {}
+                if document is not None:
+                    self.count(document, word_count_dict)
+            word_count_dict = self.result(word_count_dict)
+            if word_count_dict is None:
+                continue
+            cik_results[year] = word_count_dict
+            log_lines.extend((cik, year, k, v) for k, v in word_count_dict.items())
+        self.output.write(str(cik), cik_results, log_lines)
+
+    # The scripts go through the years in order
+    def write(self):
+        for year in sorted(self.year_results):
+            word_count_dict = self.result(self.year_results[year])
+            if word_count_dict is not None:
+                self.output.write(year, word_count_dict, [(year, k, v) for k, v in word_count_dict.items()])
+        self.output.close()
+
+class FinancialWordCountConsumer(WordCountConsumer):
+
+    def __init__(self, level, lexicon):
+        super().__init__('financial_word_count_' + level + '_stats', level, partial(count_financial_words, lexicon), cumulative = False)
+
+class FullWordCountConsumer(WordCountConsumer):
+
+    def __init__(self, level, lexicon):
+        super().__init__('full_word_count_' + level + '_stats', level, partial(count_full_words, lexicon), cumulative = True)
+
+    # The vectorizer in full_word_count_*.py returns the words in alphabetical order and skips empty extracts
+    def result(self, word_count_dict):
+        return dict(sorted(word_count_dict.items())) if word_count_dict else None
+
+def build_consumers(metrics, lexicon):
+    consumers = []
+    for metric in metrics:
+        if metric == 'sentiment':
+            consumers.append(PolarityConsumer(lexicon))
+        elif metric == 'similarity':
+            consumers.append(SimilarityConsumer())
+        elif metric.startswith('financial_word_count_'):
+            consumers.append(FinancialWordCountConsumer(metric[len('financial_word_count_'):], lexicon))
+        elif metric.startswith('full_word_count_'):
+            consumers.append(FullWordCountConsumer(metric[len('full_word_count_'):], lexicon))
+        else:
+            raise ValueError('Unknown metric: ' + metric)
+    return consumers
+
+###############################################################################
+# Single pass: every extract is read and tokenized once and passed on to all consumers
+
+if __name__ == '__main__':
+    # Verify existence of log and output directory and create if not exists, the consumers write their results as they go
+    for directory in [log_directory, output_directory]:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    lexicon = load_lexicon(dictionary_directory)
+    consumers = build_consumers(metrics, lexicon)
+
+    # Once again we are reading the master index and adding the relative paths to the files
+    master_index_df = load_master_index(master_index_df)
+
+    cik_df = master_index_df['CIK'].unique()
+
+    if corpus_directory is not None:
+        corpus = open_corpus(corpus_directory)
+
+    with tqdm(total=len(cik_df)) as pbar:
+        for cik, loop_df in iter_groups(master_index_df, 'cik'):
+            pbar.update(1)
+
+            rows = [row for index, row in loop_df.iterrows()]
+            if corpus_directory is not None:
+                documents = [read_corpus_document(corpus, row['File']) for row in rows]
+            else:
+                documents = [read_extract(row['File']) for row in rows]
+
+            for consumer in consumers:
+                consumer.consume_cik(cik, rows, documents)
+
+    for consumer in consumers:
+        consumer.write()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+This script verifies that mda_analysis.py writes exactly the same logs and JSON files as the individual scripts (sentiment.py, cosine_similarity.py, financial_word_count_*.py and full_word_count_*.py). It writes a small fixture to a temporary directory (master index, dictionaries and MD&A extracts, with several filings of a CIK in one year, empty extracts and filings without an extract, also for a whole CIK and a whole year), runs every script and mda_analysis.py on it and compares the files byte by byte. Run it after any change to the consumers or to the scripts.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+###############################################################################
+script_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Outputs (results/<name>.json and logs/<name>.log) of every script
+script_outputs = {'sentiment': 'sentiment_stats',
+                  'cosine_similarity': 'similarity_stats',
+                  'financial_word_count_cik': 'financial_word_count_cik_stats',
+                  'financial_word_count_year': 'financial_word_count_year_stats',
+                  'financial_word_count_cik_year': 'financial_word_count_cik_year_stats',
+                  'full_word_count_cik': 'full_word_count_cik_stats',
+                  'full_word_count_year': 'full_word_count_year_stats',
+                  'full_word_count_cik_year': 'full_word_count_cik_year_stats'}
+
+###############################################################################
+# Fixture
+
+dictionaries = {'stop_words.csv': ['the', 'and', 'of', 'a', 'in', 'to', 'our'],
+                'positive_words.csv': ['gain', 'improve', 'strong', 'growth'],
+                'negative_words.csv': ['loss', 'decline', 'weak', 'impairment'],
+                'litigious_words.csv': ['litigation', 'lawsuit', 'settlement']}
+
+extracts = {
+    'a': 'Net sales showed strong growth and a gain in the margin. The decline of our_costs improved results.\n',
+    'b': 'A lawsuit and the settlement of the litigation led to a loss. Sales were weak, growth was weak.\n',
+    'c': ('The company reported strong growth in all segments and expects to improve margins further. ' * 30) + '\n',
+    'd': 'Impairment of goodwill caused a loss; the decline in demand was weak but litigation ended.\n',
+    'e': 'Results were in line with the plan, no gain and no loss.\n',
+    'empty': '',
+}
+
+# (CIK, filing date, extract), None for a filing without an extract
+# CIK 1002 has no extract at all, 2004 only has a filing without an extract
+filings = [(1001, '2001-03-01', 'a'), (1001, '2001-09-01', 'b'), (1001, '2002-03-01', None), (1001, '2003-03-01', 'empty'), (1001, '2005-03-01', 'c'),
+           (1002, '2001-04-01', None), (1002, '2002-04-01', None),
+           (1003, '2004-03-01', None),
+           (1004, '2002-05-01', 'c'), (1004, '2003-05-01', 'd'), (1004, '2005-05-01', 'e'), (1004, '2005-11-01', 'empty')]
+
+# The CountVectorizer of full_word_count_year.py fails on a year without any word, it runs on the filings of the other years
+filings_without_words = [(1003, '2004-03-01', None)]
+fixtures = [(filings, [script for script in script_outputs if script != 'full_word_count_year']),
+            ([filing for filing in filings if filing not in filings_without_words], ['full_word_count_year'])]
+
+def write_fixture(directory, filings):
+    os.makedirs(directory + 'master_index')
+    os.makedirs(directory + 'master_dictionary')
+    with open(directory + 'master_index/master_index_filtered.csv', 'w') as f:
+        f.write('CIK,Company Name,Form Type,Date Filed,TXT\n')
+        for index, (cik, date, extract) in enumerate(filings):
+            accession = '{0:010d}-{1}-{2:06d}'.format(cik, date[2:4], index)
+            f.write('{0},Company {0},10-K,{1},https://www.sec.gov/Archives/edgar/data/{0}/{2}.txt\n'.format(cik, date, accession))
+            if extract is not None:
+                os.makedirs(directory + 'mda_extract/' + str(cik), exist_ok = True)
+                with open(directory + 'mda_extract/{0}/{1}.txt'.format(cik, accession), 'w', encoding = 'utf-8') as g:
+                    g.write(extracts[extract])
+    for file, words in dictionaries.items():
+        with open(directory + 'master_dictionary/' + file, 'w') as f:
+            f.write('\n'.join(words) + '\n')
+
+###############################################################################
+# Runs a script in the fixture directory and returns its outputs ({file: bytes}), None if it failed
+
+def run_script(directory, script, names):
+    for output in ['results', 'logs']:
+        shutil.rmtree(directory + output, ignore_errors = True)
+    environment = dict(os.environ, PYTHONPATH = script_directory)
+    process = subprocess.run([sys.executable, os.path.join(script_directory, script + '.py')], cwd = directory, env = environment,
+                             stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+    if process.returncode != 0:
+        print('{0} failed:\n{1}'.format(script, process.stderr.decode('utf-8', errors = 'replace')[-2000:]))
+        return None
+    outputs = {}
+    for name in names:
+        for file in ['results/' + name + '.json', 'logs/' + name + '.log']:
+            with open(directory + file, 'rb') as f:
+                outputs[file] = f.read()
+    return outputs
+
+# Returns the number of differences
+
+def check_fixture(filings, scripts):
+    differences = 0
+    directory = os.path.join(tempfile.mkdtemp(), '')
+    try:
+        write_fixture(directory, filings)
+        combined = run_script(directory, 'mda_analysis', [script_outputs[script] for script in scripts])
+        if combined is None:
+            return len(scripts)
+        for script in scripts:
+            outputs = run_script(directory, script, [script_outputs[script]])
+            if outputs is None:
+                differences += 1
+                continue
+            for file, data in outputs.items():
+                if combined[file] != data:
+                    differences += 1
+                    print('Difference in {0} ({1})'.format(file, script))
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+    return differences
+
+if __name__ == '__main__':
+    differences = 0
+    for filings, scripts in fixtures:
+        differences += check_fixture(filings, scripts)
+    print('Scripts checked: {0}, differences: {1}'.format(sum(len(scripts) for filings, scripts in fixtures), differences))
+    sys.exit(1 if differences > 0 else 0)
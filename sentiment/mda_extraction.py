@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the MD&A extraction shared by extract_mda.py and extract_mda_parallel.py. The three variants (standard, regex change and without in) used to clean up the full filing one after the other; the clean up now runs once and only the location of item 7 and item 8 differs between the variants. The match status of every variant is returned so that the calling script can write it to its own log.
+
+extract_mda_file() is the memory-mapped mode: item 7 and item 8 are located with bytes regular expressions directly on the mapped filing, the table of contents lines and item references are skipped instead of removed, and only the MD&A section is decoded (utf-8, then cp1252, then latin-1) and cleaned up. The filing is never decoded or copied as a whole, so it is much cheaper per filing, but the positions are those of the filing as downloaded and not of the cleaned up text; a handful of filings end up with a slightly different section than with extract_mda_section().
+
+Every filing has a time budget (document_time_budget) shared by all its variants: the variant running when the budget is used up is stopped and logged with a timeout status, the remaining variants are skipped, so a single malformed filing cannot block a worker. When the text mode runs out of time without a section, the memory-mapped mode is tried in the part of the budget kept for it (fallback_time_reserve).
+"""
+
+import bisect
+import contextlib
+import mmap
+import os
+import re
+import signal
+import threading
+import time
+
+from text_normalization import clean_filing, join_split_items, remove_toc_lines, remove_item_references, finalize_mda
+from text_normalization import toc_line_spans, item_reference_spans, split_item_word
+from pack_store import decode_text
+
+###############################################################################
+# The lookback serves one purpose: eliminate item 7 references, that way we can identify the right start of item 7
+# List was made based on extracting all item 7 references and compiling that into one list
+# If an item in the report gets referenced, then typically you well find one of the following words just before
+
+lookback_standard = [" Part II", " found ", " see ", " refer to ", " included in "," contained in ", " set forth ", " under ",
+                     " market risk", " Data ", " end of this ", " in ", " Note "]
+
+# Same list without " in ", as that word is too common for some filings
+lookback_without_in = [" Part II", " found ", " see ", " refer to ", " included in "," contained in ", " set forth ", " under ",
+                       " market risk", " Data ", " end of this ", " Note "]
+
+# The regex change variant does not use a lookback (below word does not exist), references are removed with a five word lookback before the word Item instead
+lookback_regex_change = [' Kabelsalat ']
+
+# Candidates for the start of item 7 (not 7A) and item 8
+item_candidate = re.compile('Ite[m\\s\\n]*7[^A(]|Ite[m\\s\\n]*8', flags=re.I)
+
+# The same pattern for the memory-mapped mode, it runs on bytes
+item_candidate_bytes = re.compile(item_candidate.pattern.encode('ascii'), flags=re.I)
+
+# The regex change variant of the memory-mapped mode also takes the word Item split over two lines, the text mode joins it first (see join_split_items())
+item_candidate_split_bytes = re.compile(item_candidate.pattern.encode('ascii').replace(b'Ite', split_item_word), flags=re.I)
+
+# Seconds all variants together may take on one filing, the variant running at the end is stopped and logged and the others are skipped (None for no limit)
+# When the standard variant of the text mode runs out of time, the filing is extracted with the memory-mapped mode, which never cleans up the full filing
+# The text mode stops fallback_time_reserve seconds before the end of the budget, the memory-mapped mode gets the rest
+# The limit needs signal.setitimer and is not applied on Windows or outside the main thread
+document_time_budget = 60
+fallback_time_reserve = 10
+
+timeout_prefix = 'Timeout '
+
+###############################################################################
+# Lookback matchers: the phrases of a lookback list in one case-insensitive pattern, compiled once per list (at import for the lists above)
+# A candidate is classified with one search of its lookback window instead of a lowercase copy of the window and a search per phrase, more phrases cost no extra pass
+# Matching without case differs from lower() only for the dotted and dotless i and the long s: these are matched as well (with case) and such a window is checked as before
+
+lookback_matchers = {}
+
+def lookback_matcher(lookback, binary=False):
+    key = (tuple(lookback), binary)
+    if key not in lookback_matchers:
+        words = [word.lower() for word in lookback]
+        lookback_max = len(max(words, key=len))+1
+        alternation = '|'.join(re.escape(word) for word in words)
+        if binary:
+            words = [word.encode('ascii') for word in words]
+            pattern = re.compile(alternation.encode('ascii'), flags=re.I)
+        elif all(word.isascii() for word in words):
+            pattern = re.compile(alternation + '|(?-i:[\u0130\u0131\u017f])', flags=re.I)
+        else:
+            pattern = None
+        lookback_matchers[key] = (words, lookback_max, pattern)
+    return lookback_matchers[key]
+
+for lookback in [lookback_standard, lookback_without_in, lookback_regex_change]:
+    lookback_matcher(lookback)
+    lookback_matcher(lookback, binary = True)
+
+# True if one of the phrases is in the lookback window before the candidate at index, as any(word in data[index-lookback_max:index].lower() ...)
+# That window wraps around to the end of the data for a candidate within lookback_max of the start, the search covers the same characters
+
+def is_reference(data, index, matcher):
+    words, lookback_max, pattern = matcher
+    if pattern is not None:
+        start = index - lookback_max
+        if start < 0:
+            start = max(0, len(data) + start)
+        m = pattern.search(data, start, index)
+        if m is None:
+            return False
+        if m.group().lower() in words:
+            return True
+    return any(word in data[index-lookback_max:index].lower() for word in words)
+
+###############################################################################
+# Below function locates the MD&A section (item 7 up to item 8) in a cleaned filing, a str or a bytes buffer (bytes, mmap)
+# Candidates that start inside one of the excluded spans (sorted start and end positions) are skipped
+# Returns the start and end of the section (None if not found) and the match status for the log
+
+def locate_mda_bounds(data, lookback, file, debug=False, candidates=item_candidate, excluded=None):
+    matcher = lookback_matcher(lookback, not isinstance(data, str))
+    seven, eight, discussion, financial = '7', '8', 'discussion', 'financial'
+    if not isinstance(data, str):
+        seven, eight, discussion, financial = b'7', b'8', b'discussion', b'financial'
+
+    # One pass over the candidates, the matched text and position are taken from the same match object
+    find_items = []
+    find_indices = []
+    new_find_items = []
+    new_find_indices = []
+    for m in candidates.finditer(data):
+        item = m.group()
+        index = m.start()
+        if excluded is not None:
+            span = bisect.bisect_right(excluded[0], index) - 1
+            if span >= 0 and index < excluded[1][span]:
+                continue
+        find_items.append(item)
+        find_indices.append(index)
+        if not is_reference(data, index, matcher):
+            new_find_items.append(item)
+            new_find_indices.append(index)
+
+    item_matches = []
+    for index in range(len(new_find_items)-1):
+        if seven in new_find_items[index] and eight in new_find_items[index+1]:
+            range7 = new_find_indices[index] # 30 characters allows to look for the word discussion
+            range8 = new_find_indices[index+1] # 30 characters allows to look for the word financial
+            if discussion in data[range7:range7+40].lower() and financial in data[range8:range8+40].lower():
+                item_matches.append((new_find_indices[index],new_find_indices[index+1]))
+
+    if len(item_matches) > 1:
+        item_match = max(item_matches,key=lambda item:item[1]-item[0])
+        return item_match, 'Multiple match ' + str(file) + ':' + str(item_match) + 'len' + str(len(item_matches))
+
+    elif len(item_matches) == 0:
+        if debug == True:
+            print(file)
+            print(find_items)
+            print(find_indices)
+            print(new_find_items)
+            print(new_find_indices)
+        return None, 'Empty match ' + str(file)
+
+    else:
+        item_match = item_matches[0]
+        return item_match, 'Single match ' + str(file) + ':' + str(item_match)
+
+# Returns the section (empty if not found) and the match status for the log
+
+def locate_mda(data, lookback, file, debug=False):
+    item_match, status = locate_mda_bounds(data, lookback, file, debug)
+    if item_match is None:
+        return '', status
+    return data[item_match[0] : item_match[1]], status
+
+###############################################################################
+# Time budget of a filing: SIGALRM interrupts the regular expressions and the clean up wherever they are
+# The budget is a deadline (time.monotonic()) passed on to the variants, every variant is given the time left
+
+class TimeBudgetExceeded(Exception):
+    pass
+
+def budget_expired(signum, frame):
+    raise TimeBudgetExceeded()
+
+@contextlib.contextmanager
+def time_budget(seconds):
+    if seconds is None or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    if seconds <= 0:
+        raise TimeBudgetExceeded()
+    previous = signal.signal(signal.SIGALRM, budget_expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def document_deadline():
+    if document_time_budget is None:
+        return None
+    return time.monotonic() + document_time_budget
+
+def time_left(deadline, reserve=0):
+    if deadline is None:
+        return None
+    return deadline - reserve - time.monotonic()
+
+def is_timeout(status):
+    return status.startswith(timeout_prefix)
+
+# Below function runs the variants, given as (name, function returning the MD&A section and the match status), in order until one returns a section of at least size_threshold characters
+# The variants run until deadline less reserve seconds: the variant running then gets a timeout status and the remaining ones are skipped
+# Returns the section of the first variant that qualified, otherwise the one of the first variant (None if that one ran out of time), and the status of every variant that ran
+
+def run_variants(variants, file, size_threshold, deadline, reserve=0):
+    status_list = []
+    first_mda = None
+    for index, (name, variant) in enumerate(variants):
+        try:
+            with time_budget(time_left(deadline, reserve)):
+                data_mda, status = variant()
+        except TimeBudgetExceeded:
+            status_list.append(timeout_prefix + name + ' ' + str(file) + ' (time budget of ' + str(document_time_budget) + ' s used up)')
+            break
+        status_list.append(status)
+        if index == 0:
+            first_mda = data_mda
+        if len(data_mda) >= size_threshold:
+            return data_mda, status_list
+    return first_mda, status_list
+
+###############################################################################
+# Below function runs the variants in order until one returns an MD&A section of at least size_threshold characters
+# If none of them does, the result of the standard variant is kept
+# Returns the MD&A section and the match status of every variant that ran
+
+def extract_mda_section(data, file, size_threshold, debug=False):
+    deadline = document_deadline()
+
+    # Clean up shared by the variants, kept once done
+    cleaned_up = {}
+
+    def cleaned():
+        if 'cleaned' not in cleaned_up:
+            cleaned_up['cleaned'] = clean_filing(data)
+        return cleaned_up['cleaned']
+
+    def cleaned_without_toc():
+        if 'without_toc' not in cleaned_up:
+            cleaned_up['without_toc'] = remove_toc_lines(cleaned())
+        return cleaned_up['without_toc']
+
+    def standard():
+        data_mda, status = locate_mda(cleaned_without_toc(), lookback_standard, file, debug)
+        return finalize_mda(data_mda), status
+
+    # The regex change variant joins the word Item when split over two lines before the clean up
+    # If there is nothing to join (and no carriage return to remove), the cleaned filing above can be reused
+    def regex_change():
+        joined = join_split_items(data)
+        data_mda, status = locate_mda(remove_item_references(clean_filing(joined) if joined != data else cleaned()),
+                                      lookback_regex_change, file, debug)
+        return finalize_mda(data_mda), status
+
+    def without_in():
+        data_mda, status = locate_mda(cleaned_without_toc(), lookback_without_in, file, debug)
+        return finalize_mda(data_mda), status
+
+    data_mda, status_list = run_variants([('standard', standard), ('regex change', regex_change), ('without in', without_in)],
+                                         file, size_threshold, deadline, fallback_time_reserve)
+    if data_mda is None:
+        # The standard variant ran out of time: the memory-mapped mode on the encoded filing, in what is left of the budget
+        data_mda, buffer_status_list = extract_mda_buffer(data.encode('utf-8', errors = 'replace'), file, size_threshold, debug, deadline)
+        status_list.extend(buffer_status_list)
+    return data_mda, status_list
+
+###############################################################################
+# Memory-mapped mode: the filing is only read through the mapping, the MD&A section is the only part that is decoded
+
+# The section is decoded as the loose files and the packs (see decode_text() in pack_store.py)
+# The regex change variant joins the word Item when split over two lines, as in extract_mda_section()
+
+def mda_section(buffer, item_match, join_items=False):
+    if item_match is None:
+        return ''
+    data = decode_text(buffer[item_match[0] : item_match[1]])
+    if join_items:
+        data = join_split_items(data)
+    return finalize_mda(clean_filing(data))
+
+# Below function runs the variants in the same order and with the same size threshold as extract_mda_section() on a bytes buffer (bytes or mmap)
+# The lines of the table of contents and the item references are skipped (see toc_line_spans() and item_reference_spans()), the text mode removes them
+# Lines end with \r\n, \r or \n and the regex change variant finds the word Item split over two lines, as the text mode does after universal newlines and join_split_items()
+# The deadline of the filing is started here unless given (see extract_mda_section())
+# Returns an empty section if the standard variant ran out of time
+
+def extract_mda_buffer(buffer, file, size_threshold, debug=False, deadline=None):
+    if deadline is None:
+        deadline = document_deadline()
+    spans = {}
+
+    def toc_spans():
+        if 'toc' not in spans:
+            spans['toc'] = toc_line_spans(buffer)
+        return spans['toc']
+
+    def standard():
+        item_match, status = locate_mda_bounds(buffer, lookback_standard, file, debug, item_candidate_bytes, toc_spans())
+        return mda_section(buffer, item_match), status
+
+    def regex_change():
+        item_match, status = locate_mda_bounds(buffer, lookback_regex_change, file, debug, item_candidate_split_bytes,
+                                               item_reference_spans(buffer, split_items = True))
+        return mda_section(buffer, item_match, join_items = True), status
+
+    def without_in():
+        item_match, status = locate_mda_bounds(buffer, lookback_without_in, file, debug, item_candidate_bytes, toc_spans())
+        return mda_section(buffer, item_match), status
+
+    data_mda, status_list = run_variants([('standard', standard), ('regex change', regex_change), ('without in', without_in)],
+                                         file, size_threshold, deadline)
+    if data_mda is None:
+        data_mda = ''
+    return data_mda, status_list
+
+# An empty file cannot be mapped
+
+def extract_mda_file(path, file, size_threshold, debug=False):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return extract_mda_buffer(b'', file, size_threshold, debug)
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+            return extract_mda_buffer(buffer, file, size_threshold, debug)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+This module stores the cleaned filings or the MD&A extracts in a few large files instead of hundreds of thousands of small ones. All filings of one CIK (or of one filing year) are appended to one pack file (<CIK>.pack) with an offset index next to it (<CIK>.idx, one line per filing: file, offset, length, size and codec). Every record can be compressed on its own (zlib), so a single filing is read with one seek. A packed directory is recognized by its pack.json; the scripts read through open_document(), which also works on the usual CIK/accession.txt directories. To convert an existing directory: python pack_store.py ./mda_extract/ ./mda_packed/
+"""
+
+import argparse
+import io
+import json
+import os
+import zlib
+from tqdm import tqdm
+
+###############################################################################
+pack_settings_file = 'pack.json'
+pack_extension = '.pack'
+index_extension = '.idx'
+
+# One pack per CIK ('cik') or per filing year ('year') and the compression of every record ('zlib' or 'none')
+pack_by = 'cik'
+pack_codec = 'zlib'
+compression_level = 6
+
+# Encoding of the text written to the records
+text_encoding = 'utf-8'
+
+# Encodings tried when reading a filing or an extract, loose or packed (the loose files are written in the preferred encoding of the downloading machine)
+# latin-1 decodes every byte and comes last
+text_encodings = ['utf-8', 'cp1252', 'latin-1']
+
+# Open pack files per writer and reader, the least recently used one is closed first
+max_open_packs = 64
+
+###############################################################################
+# All text is decoded here, the first encoding of text_encodings that fits is used
+
+def decode_text(data):
+    for encoding in text_encodings:
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        text = data.decode(text_encodings[-1], errors = 'replace')
+    # Universal newlines, as the text mode reads the files
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def is_packed(directory):
+    return os.path.isfile(directory + pack_settings_file)
+
+def pack_settings(directory):
+    with open(directory + pack_settings_file, 'r') as f:
+        return json.load(f)
+
+# Name of the pack of a file (CIK/accession.txt): the CIK, or the filing year
+
+def pack_name(file, by, year=None):
+    if by == 'year':
+        if year is None:
+            raise ValueError('The filing year is needed for packs by year: ' + file)
+        return str(year)
+    return file.split('/')[0]
+
+def compress_record(data, codec):
+    if codec == 'zlib':
+        return zlib.compress(data, compression_level)
+    return data
+
+def decompress_record(data, codec):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    return data
+
+###############################################################################
+# Below class appends records to the packs of a directory
+# The record is written and flushed before its index line, an interrupted run never leaves an index line without its record
+# A file written twice is found at its last record (the converter can be used to compact the packs)
+
+class PackWriter:
+
+    def __init__(self, directory, by=pack_by, codec=pack_codec):
+        os.makedirs(directory, exist_ok = True)
+        if is_packed(directory):
+            settings = pack_settings(directory)
+            by = settings['by']
+        else:
+            with open(directory + pack_settings_file, 'w') as f:
+                json.dump({'by': by}, f)
+        self.directory = directory
+        self.by = by
+        self.codec = codec
+        self.packs = {}
+
+    def open_pack(self, name):
+        if name in self.packs:
+            # Most recently used at the end
+            self.packs[name] = self.packs.pop(name)
+            return self.packs[name]
+        if len(self.packs) >= max_open_packs:
+            oldest = next(iter(self.packs))
+            for f in self.packs.pop(oldest):
+                f.close()
+        self.packs[name] = (open(self.directory + name + pack_extension, 'ab'),
+                            open(self.directory + name + index_extension, 'a', encoding = 'utf-8', newline = '\n'))
+        return self.packs[name]
+
+    def write(self, file, data, year=None):
+        packf, indexf = self.open_pack(pack_name(file, self.by, year))
+        record = compress_record(data, self.codec)
+        offset = packf.tell()
+        packf.write(record)
+        packf.flush()
+        indexf.write('{0},{1},{2},{3},{4}\n'.format(file, offset, len(record), len(data), self.codec))
+        indexf.flush()
+
+    def write_text(self, file, data, year=None):
+        self.write(file, data.encode(text_encoding), year)
+
+    # The reader of the directory (see pack_reader()) does not know the new records, it is created again when needed
+    def close(self):
+        for packf, indexf in self.packs.values():
+            packf.close()
+            indexf.close()
+        self.packs = {}
+        close_reader(self.directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+###############################################################################
+# Below class reads records from the packs of a directory, the index of a pack is only read when one of its files is needed
+# Packs by year are few, their indexes are all read at once
+
+class PackReader:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.by = pack_settings(directory)['by']
+        self.records = {}
+        self.loaded = set()
+        self.all_loaded = False
+        self.files = {}
+
+    def load_index(self, name):
+        if name in self.loaded:
+            return
+        self.loaded.add(name)
+        if not os.path.isfile(self.directory + name + index_extension):
+            return
+        pack_size = os.path.getsize(self.directory + name + pack_extension)
+        with open(self.directory + name + index_extension, 'r', encoding = 'utf-8', newline = '\n') as f:
+            for line in f:
+                fields = line.rstrip('\n').split(',')
+                # A line cut off by a crash, or a record that never made it to the pack
+                if len(fields) != 5 or not line.endswith('\n') or int(fields[1]) + int(fields[2]) > pack_size:
+                    continue
+                self.records[fields[0]] = (name, int(fields[1]), int(fields[2]), int(fields[3]), fields[4])
+
+    def load_all(self):
+        if self.all_loaded:
+            return
+        self.all_loaded = True
+        for entry in sorted(os.listdir(self.directory)):
+            if entry.endswith(index_extension):
+                self.load_index(entry[:-len(index_extension)])
+
+    def record(self, file):
+        if self.by == 'year':
+            self.load_all()
+        else:
+            self.load_index(pack_name(file, self.by))
+        return self.records.get(file)
+
+    def __contains__(self, file):
+        return self.record(file) is not None
+
+    def existing_record(self, file):
+        record = self.record(file)
+        if record is None:
+            raise FileNotFoundError('Not in the packs of {0}: {1}'.format(self.directory, file))
+        return record
+
+    def size(self, file):
+        return self.existing_record(file)[3]
+
+    def read(self, file):
+        name, offset, length, size, codec = self.existing_record(file)
+        if name in self.files:
+            # Most recently used at the end
+            self.files[name] = self.files.pop(name)
+        else:
+            if len(self.files) >= max_open_packs:
+                self.files.pop(next(iter(self.files))).close()
+            self.files[name] = open(self.directory + name + pack_extension, 'rb')
+        f = self.files[name]
+        f.seek(offset)
+        return decompress_record(f.read(length), codec)
+
+    def read_text(self, file):
+        return decode_text(self.read(file))
+
+    def all_files(self):
+        self.load_all()
+        return list(self.records)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+###############################################################################
+# Access for the scripts, the same calls for a packed directory and a directory of loose files
+# One reader per packed directory and process (None for a directory of loose files), the open packs are reused from one filing to the next
+
+readers = {}
+
+def pack_reader(directory):
+    if directory not in readers:
+        readers[directory] = PackReader(directory) if is_packed(directory) else None
+    return readers[directory]
+
+def close_reader(directory):
+    reader = readers.pop(directory, None)
+    if reader is not None:
+        reader.close()
+
+# The loose files are read as bytes and decoded as the records
+
+def open_document(directory, file):
+    reader = pack_reader(directory)
+    if reader is None:
+        with open(directory + file, 'rb') as f:
+            return io.StringIO(decode_text(f.read()))
+    return io.StringIO(reader.read_text(file))
+
+def document_exists(directory, file):
+    reader = pack_reader(directory)
+    if reader is None:
+        return os.path.isfile(directory + file)
+    return file in reader
+
+def document_size(directory, file):
+    reader = pack_reader(directory)
+    if reader is None:
+        return os.path.getsize(directory + file)
+    return reader.size(file)
+
+# Below function returns the size and the version of a document, a document that is written again gets another version ((-1, -1) if it does not exist)
+# The version is the modification time (ns) of a loose file, or the position of the record in its pack (records are only appended)
+
+def document_version(directory, file):
+    reader = pack_reader(directory)
+    if reader is None:
+        try:
+            stat = os.stat(directory + file)
+        except OSError:
+            return -1, -1
+        return stat.st_size, stat.st_mtime_ns
+    record = reader.record(file)
+    if record is None:
+        return -1, -1
+    return record[3], record[1]
+
+###############################################################################
+# Converts a directory of loose files (CIK/accession.txt) into packs, e.g. python pack_store.py ./edgar_download/ ./edgar_packed/
+# The files are taken in the order of the master index, so the filings of one CIK are next to each other in its pack
+
+if __name__ == '__main__':
+    from master_index import load_master_index, index_file
+
+    parser = argparse.ArgumentParser(description = 'Convert a directory of filings or MD&A extracts into packs')
+    parser.add_argument('input', help = 'directory with CIK/accession.txt files')
+    parser.add_argument('output', help = 'packed directory')
+    parser.add_argument('--by', choices = ['cik', 'year'], default = pack_by, help = 'one pack per CIK or per filing year')
+    parser.add_argument('--codec', choices = ['zlib', 'none'], default = pack_codec, help = 'compression of the records')
+    parser.add_argument('--index', default = index_file, help = 'filtered master index')
+    args = parser.parse_args()
+    input_dir = os.path.join(args.input, '')
+    output_dir = os.path.join(args.output, '')
+
+    master_index_df = load_master_index(args.index)
+    number_of_files = 0
+    with PackWriter(output_dir, args.by, args.codec) as writer:
+        for file, year in tqdm(zip(master_index_df['File'], master_index_df['Year']), total = master_index_df.shape[0]):
+            if document_exists(input_dir, file) and not document_exists(output_dir, file):
+                # Read as the scripts read the loose files (text mode, universal newlines)
+                try:
+                    with open_document(input_dir, file) as f:
+                        data = f.read()
+                except Exception as e:
+                    print(e)
+                    continue
+                writer.write_text(file, data, year)
+                number_of_files += 1
+
+    print('Files packed: ', number_of_files)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps the raw EDGAR submissions in a compressed store (edgar_raw/) before they are cleaned, so a change in the clean up never means downloading the ~500 GB again (see reclean_10k.py). Every submission is stored once under the SHA-256 of its content (objects/ab/abcd....zst or .gz); a filing with several filers has the same accession number under every CIK and ends up as one blob. The index (index.sqlite) maps the accession number to its blob. zstd is used when the zstandard package is installed, gzip otherwise (reading a zstd blob needs the package as well).
+"""
+
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+###############################################################################
+raw_directory = './edgar_raw/'
+index_file = 'index.sqlite'
+objects_directory = 'objects/'
+
+# The downloaders store every raw submission before cleaning it, set to False to only keep the cleaned 10-K as before
+keep_raw_submissions = True
+
+# Codec of new blobs and the compression levels
+raw_codec = 'zst' if zstandard is not None else 'gz'
+compression_level = {'gz': 6, 'zst': 10}
+
+chunk_size = 1024*1024
+
+###############################################################################
+# One row per accession number: the blob (SHA-256 of the raw submission), its codec and the raw and stored size in bytes
+
+def open_store(directory=raw_directory):
+    os.makedirs(directory + objects_directory, exist_ok = True)
+    conn = sqlite3.connect(directory + index_file, timeout = 60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS blobs ('
+                 'accession TEXT PRIMARY KEY, digest TEXT NOT NULL, codec TEXT NOT NULL, size INTEGER, stored_size INTEGER)')
+    conn.commit()
+    return conn
+
+# The downloaders look up and store every filing through one connection per store, opened on first use
+# A connection is kept per process and thread, SQLite connections cannot be shared with a forked process or another thread
+
+connections = {}
+
+def store_connection(directory=raw_directory):
+    key = (directory, os.getpid(), threading.get_ident())
+    if key not in connections:
+        connections[key] = open_store(directory)
+    return connections[key]
+
+# The file of the master index is CIK/accession.txt
+
+def accession_of(file):
+    return os.path.splitext(os.path.basename(file))[0]
+
+def blob_path(directory, digest, codec):
+    return directory + objects_directory + digest[:2] + '/' + digest + '.' + codec
+
+def stored_blobs(conn):
+    return {accession: (digest, codec, stored_size) for (accession, digest, codec, stored_size)
+            in conn.execute('SELECT accession, digest, codec, stored_size FROM blobs')}
+
+def lookup_blob(conn, accession):
+    return conn.execute('SELECT digest, codec FROM blobs WHERE accession = ?', (accession,)).fetchone()
+
+###############################################################################
+# Compressed writer and reader per codec, both work on binary file objects
+
+def compressed_writer(f, codec):
+    if codec == 'gz':
+        return gzip.GzipFile(fileobj = f, mode = 'wb', compresslevel = compression_level['gz'], mtime = 0)
+    if zstandard is None:
+        raise ValueError('The zstandard package is needed for codec zst')
+    return zstandard.ZstdCompressor(level = compression_level['zst']).stream_writer(f, closefd = False)
+
+def open_blob(directory, digest, codec):
+    if codec == 'gz':
+        return gzip.open(blob_path(directory, digest, codec), 'rb')
+    if zstandard is None:
+        raise ValueError('The zstandard package is needed for codec zst')
+    return zstandard.ZstdDecompressor().stream_reader(open(blob_path(directory, digest, codec), 'rb'), closefd = True)
+
+###############################################################################
+# Below function adds the submission in path to the store under its accession number and returns its digest
+# The submission is hashed and compressed in one pass into a temporary file, which is renamed to its digest when done
+# A blob that is already there (same content) is not written again
+
+def store_submission(path, accession, directory=raw_directory, codec=raw_codec):
+    conn = store_connection(directory)
+    temporary_path = directory + objects_directory + accession + '.{0}.tmp'.format(os.getpid())
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as raw, open(temporary_path, 'wb') as f:
+        with compressed_writer(f, codec) as writer:
+            while True:
+                chunk = raw.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                writer.write(chunk)
+                size += len(chunk)
+    digest = digest.hexdigest()
+
+    target = blob_path(directory, digest, codec)
+    if os.path.isfile(target):
+        os.remove(temporary_path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok = True)
+        os.replace(temporary_path, target)
+
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO blobs (accession, digest, codec, size, stored_size) VALUES (?, ?, ?, ?, ?)',
+                     (accession, digest, codec, size, os.path.getsize(target)))
+    return digest
+
+def is_stored(accession, directory=raw_directory):
+    return lookup_blob(store_connection(directory), accession) is not None
+
+# Binary file object with the raw submission of the accession number, None if it is not in the store
+
+def open_submission(accession, directory=raw_directory):
+    blob = lookup_blob(store_connection(directory), accession)
+    if blob is None:
+        return None
+    return open_blob(directory, blob[0], blob[1])
+
+###############################################################################
+# Overview of the store, e.g. python raw_store.py
+
+if __name__ == '__main__':
+    conn = open_store(raw_directory)
+    accessions, = conn.execute('SELECT COUNT(*) FROM blobs').fetchone()
+    blobs, size, stored_size = conn.execute(
+        'SELECT COUNT(*), SUM(size), SUM(stored_size) FROM (SELECT DISTINCT digest, size, stored_size FROM blobs)').fetchone()
+    print('Accession numbers: ', accessions)
+    print('Blobs: ', blobs)
+    if accessions > 0:
+        print('Raw size: {0:.1f} MB, stored size: {1:.1f} MB'.format(size / 1024**2, stored_size / 1024**2))
+    conn.close()
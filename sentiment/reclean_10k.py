@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+This script cleans the 10-K filings again from the raw submissions in the raw store (see raw_store.py), e.g. after a change in the clean up (text_normalization.py). Nothing is downloaded: the blobs are decompressed and cleaned by a pool of processes that take their work in batches (see work_scheduler.py), so a full re-clean is bounded by the local CPU and not by the network. It can be run as often as needed; filings without a raw submission in the store are logged and left as they are.
+"""
+
+import argparse
+import os
+import time
+from tqdm import tqdm
+
+from edgar_submission import clean_stored_submission
+from master_index import load_master_index
+from raw_store import raw_directory, accession_of, open_store, stored_blobs
+from work_scheduler import run_scheduled, worker_report
+
+###############################################################################
+master_index_df = 'master_index/master_index_filtered.csv'
+output_directory = './edgar_download/'
+log_file = 'reclean_error.log'
+
+###############################################################################
+# Runs in the worker process: the cleaned 10-K document of one filing given as (file, download path, raw store)
+# Returns the file and the error message (None when successful)
+
+def reclean_filing(task):
+    file, dl_dir, directory = task
+    try:
+        os.makedirs(os.path.dirname(dl_dir + file), exist_ok = True)
+        clean_stored_submission(dl_dir + file, accession_of(file), directory)
+    except Exception as e:
+        return file, str(e)
+    return file, None
+
+###############################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Clean the 10-K filings again from the raw store')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'number of worker processes (default: number of CPUs)')
+    parser.add_argument('--index', default = master_index_df, help = 'filtered master index')
+    parser.add_argument('--raw', default = raw_directory, help = 'raw store directory')
+    parser.add_argument('--output', default = output_directory, help = 'directory of the cleaned filings')
+    args = parser.parse_args()
+    store_dir = os.path.join(args.raw, '')
+    dl_dir = os.path.join(args.output, '')
+
+    master_index_df = load_master_index(args.index)
+    conn = open_store(store_dir)
+    blobs = stored_blobs(conn)
+    conn.close()
+
+    # Batches are balanced on the compressed size of the submissions
+    tasks = []
+    sizes = []
+    missing_files = []
+    for file in master_index_df['File']:
+        blob = blobs.get(accession_of(file))
+        if blob is None:
+            missing_files.append(file)
+        else:
+            tasks.append((file, dl_dir, store_dir))
+            sizes.append(blob[2])
+
+    start = time.perf_counter()
+    number_of_files = 0
+    worker_stats = {}
+    with open(log_file, 'w') as logf, tqdm(total=len(tasks)) as pbar:
+        for file in missing_files:
+            logf.write('Not in the raw store {0}\n'.format(file))
+        for results in run_scheduled(reclean_filing, tasks, sizes, args.workers, worker_stats):
+            pbar.update(len(results))
+            for file, error in results:
+                if error is None:
+                    number_of_files += 1
+                else:
+                    logf.write('Failed to clean {0}: {1}\n'.format(file, error))
+
+    print('Cleaned {0} filings in {1:.1f} seconds, {2} not in the raw store'.format(number_of_files, time.perf_counter() - start, len(missing_files)))
+    for line in worker_report(worker_stats):
+        print(line)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+This module writes the results of the word count scripts one record at a time instead of keeping the whole nested dictionary in memory until the end. Every record (e.g. the word counts of one CIK) is appended as one line of JSON to an NDJSON file next to the JSON output (results/full_word_count_cik_stats.ndjson) and flushed, so the records written before a crash can still be read (a new run starts the file over). When the script is done, the JSON file is written from the NDJSON file record by record, in exactly the shape and format of json.dump on the full dictionary. load_results() rebuilds the dictionary from either file, e.g. for the visualization.
+"""
+
+import json
+import os
+
+###############################################################################
+ndjson_extension = '.ndjson'
+
+def ndjson_path(json_path):
+    return os.path.splitext(json_path)[0] + ndjson_extension
+
+###############################################################################
+# One line per record: {"<key>": <value>}, i.e. one entry of the dictionary that used to be dumped at the end
+
+class ResultsWriter:
+    def __init__(self, json_path, write_json=True):
+        self.json_path = json_path
+        self.ndjson_path = ndjson_path(json_path)
+        self.write_json = write_json
+        self.f = open(self.ndjson_path, 'w', encoding = 'utf-8')
+
+    def write(self, key, value):
+        self.f.write(json.dumps({key: value}) + '\n')
+        self.f.flush()
+
+    # The JSON file is only (re)written once all records are in
+    def close(self):
+        self.f.close()
+        if self.write_json:
+            ndjson_to_json(self.ndjson_path, self.json_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+###############################################################################
+# Yields (key, value) per record, a line cut off by a crash is skipped
+
+def read_records(path):
+    with open(path, 'r', encoding = 'utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            for key, value in record.items():
+                yield key, value
+
+# Below function writes the JSON file from the NDJSON file without loading all records
+# The output is the same as json.dump of the dictionary (same separators), the keys of the records are unique
+
+def ndjson_to_json(path, json_path):
+    with open(json_path + '.tmp', 'w') as f:
+        f.write('{')
+        for index, (key, value) in enumerate(read_records(path)):
+            f.write((', ' if index > 0 else '') + json.dumps(key) + ': ' + json.dumps(value))
+        f.write('}')
+    os.replace(json_path + '.tmp', json_path)
+
+###############################################################################
+# Below function returns the results as the dictionary stored in the JSON file
+# The NDJSON file is used when it is newer than the JSON file (e.g. the JSON was never written because the run did not finish)
+
+def load_results(json_path):
+    path = ndjson_path(json_path)
+    if os.path.isfile(path) and (not os.path.isfile(json_path) or os.path.getmtime(path) > os.path.getmtime(json_path)):
+        return dict(read_records(path))
+    with open(json_path, 'r') as f:
+        return json.load(f)
@@ -7,12 +7,12 @@ Version 1.0 dated 04-Apr-2020
 This script calculates the polarity for each MD&A section and stores its results in logs/ and results/ in a log and JSON file respectively.
 """
 
-import pandas as pd
 import os
 from tqdm import tqdm
 import json
-import csv
-import re
+
+from master_index import load_master_index, sort_by_group, iter_groups
+from pack_store import open_document
 
 ###############################################################################
 # We are taking the output of the download_clean_10k script.
@@ -48,35 +48,18 @@ def stemmer(data, enabled):
 
 stemmer_enabled = False
 
-###############################################################################
-# Function to read in csv files for the sentiment dictionaries
-
-def dict_csv_reader(dict_file):
-    output = []
-    with open(dict_file, newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            output.append(row[0])
-        return output
-
 ###############################################################################
 # Import sentiment dictionaries based no Loughran & McDonald
+# The dictionaries are loaded once into sets (see lexicon.py) to avoid a linear scan per word
 
-stop_words_csv = 'stop_words.csv'
-positive_words_csv = 'positive_words.csv'
-negative_words_csv = 'negative_words.csv'
-litigious_words_csv  = 'litigious_words.csv'
+from lexicon import load_lexicon, tokenize, polarity_counts, polarity_score, batch_polarity_counts
 
-stop_words = dict_csv_reader(dictionary_directory + stop_words_csv)
-positive_words = dict_csv_reader(dictionary_directory + positive_words_csv)
-negative_words = dict_csv_reader(dictionary_directory + negative_words_csv)
-litigious_words  = dict_csv_reader(dictionary_directory + litigious_words_csv)
+lexicon = load_lexicon(dictionary_directory)
 
 ###############################################################################
 # Once again we are reading the master index and adding the relative paths to the files
 
-master_index_df = pd.read_csv(master_index_df, sep = ',')
-master_index_df['File'] = master_index_df['TXT'].str.split('/', expand = True)[6] + '/' + master_index_df['TXT'].str.split('/', expand = True)[7]
+master_index_df = load_master_index(master_index_df)
 
 ###############################################################################
 # In below code we are calculating the relative proportional difference based on the dictionaries of Loughran & McDonald
@@ -95,49 +78,71 @@ cik_df = master_index_df['CIK'].unique()
 # We found that below 2 KB we have this behaviour consistently
 mda_size_threshold = 2048
 
-# Include progress bar (tqdm library)
-with tqdm(total=len(cik_df)) as pbar:
-    for cik in cik_df:
-        pbar.update(1)
-        loop_df = master_index_df[master_index_df['CIK'] == cik].sort_values(by=['Date Filed'], ascending=True)
-
-        # We'll store the filed dates in a separate list for easier processing
-        date_list = []
-        sentiment_list = []
-        for index, row in loop_df.iterrows():
-            sentiment_score = 0.0
-            pos = 0.0
-            neg = 0.0
-            lit = 0.0
+# Batch mode scores the whole corpus at once with a sparse document-term matrix (see lexicon.py)
+# Set to False to fall back to the original loop per CIK and per word
+batch_mode = True
+
+# Reads the MD&A extracts one by one for the vectorizer, files that cannot be read are left out of the results
+read_errors = set()
+
+def read_corpus(df):
+    with tqdm(total=df.shape[0]) as pbar:
+        for index, file in zip(df.index, df['File']):
+            pbar.update(1)
             try:
-                with open(input_directory + row['File'], 'r+', encoding = 'mbcs') as f:
-                    data = f.read().lower()
-
-                    date_list.append(row['Date Filed'])
-
-                    data_without_stop_words  = [word for word in re.split("\W+", data) if word not in stop_words and len(word) > 1]
-
-                    for word in data_without_stop_words:
-                        if word in positive_words:
-                            pos += 1.0
-                        if word in negative_words:
-                            neg += 1.0
-                        if word in litigious_words:
-                            lit += 1.0
-                    # Basic metric Relative Proportional Difference (between -1 and 1)
-                    if (pos+neg) != 0.0:
-                        sentiment_score = round((pos-neg) / (pos+neg), 4)
-                    else:
-                        sentiment_score = 0.0
+                with open_document(input_directory, file) as f:
+                    data = f.read()
             except Exception as e:
                 print(e)
-            sentiment_list.append(sentiment_score)
+                read_errors.add(index)
+                data = ''
+            yield data
+
+if batch_mode:
+    # The master index is already ordered by CIK and filing date (see master_index.py)
+    batch_df = sort_by_group(master_index_df, 'cik')
 
-        sentiment_results_dict[str(cik)] = {dt:cs for (cs, dt) in zip(sentiment_list, date_list)}
+    pos, neg, lit = batch_polarity_counts(read_corpus(batch_df), lexicon)
+    sentiment_list = [polarity_score(float(p), float(n)) for (p, n) in zip(pos, neg)]
 
-        for cs, dt in zip(sentiment_list, date_list):
+    for cik in cik_df:
+        sentiment_results_dict[str(cik)] = {}
+    for index, cik, dt, cs in zip(batch_df.index, batch_df['CIK'], batch_df['Date Filed'], sentiment_list):
+        if index not in read_errors:
+            sentiment_results_dict[str(cik)][dt] = cs
             statsf.write(str(cik) + ',' + str(dt) + ',' + str(cs) +'\n')
 
+else:
+    # Include progress bar (tqdm library)
+    with tqdm(total=len(cik_df)) as pbar:
+        for cik, loop_df in iter_groups(master_index_df, 'cik'):
+            pbar.update(1)
+
+            # We'll store the filed dates in a separate list for easier processing
+            date_list = []
+            sentiment_list = []
+            for index, row in loop_df.iterrows():
+                sentiment_score = 0.0
+                try:
+                    with open_document(input_directory, row['File']) as f:
+                        data = f.read().lower()
+
+                        date_list.append(row['Date Filed'])
+
+                        data_without_stop_words = tokenize(data, lexicon)
+
+                        pos, neg, lit = polarity_counts(data_without_stop_words, lexicon)
+                        # Basic metric Relative Proportional Difference (between -1 and 1)
+                        sentiment_score = polarity_score(pos, neg)
+                except Exception as e:
+                    print(e)
+                sentiment_list.append(sentiment_score)
+
+            sentiment_results_dict[str(cik)] = {dt:cs for (cs, dt) in zip(sentiment_list, date_list)}
+
+            for cs, dt in zip(sentiment_list, date_list):
+                statsf.write(str(cik) + ',' + str(dt) + ',' + str(cs) +'\n')
+
 # Verify existence of output directory and create if not exists
 if not os.path.exists(output_directory):
     os.makedirs(output_directory)
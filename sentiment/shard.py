@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+This script splits the download and the MD&A extraction over several machines (nodes). Every node runs the same script with --shard i/N and only processes the companies whose Central Index Key hashes to shard i, so all filings of one company end up on the same node. Each node writes a manifest of the files it completed into its output directory. The merge step (python shard.py <output directory> <node directories>) copies the outputs of all nodes into one directory and combines the manifests. To try it on one machine, run N processes with different --shard values and output directories, then merge.
+"""
+
+import pandas as pd
+import argparse
+import glob
+import os
+import re
+import shutil
+import zlib
+
+from pack_store import PackWriter, is_packed, pack_reader, document_exists, document_size
+
+###############################################################################
+manifest_prefix = 'manifest'
+manifest_columns = ['File', 'Size']
+
+###############################################################################
+# Shards are numbered 1 to N (like the chunks in download_clean_10k.py), e.g. --shard 2/5
+
+def parse_shard(text):
+    match = re.fullmatch('(\\d+)/(\\d+)', text.strip())
+    if match is None:
+        raise ValueError('Shard should be given as i/N, e.g. 2/5: ' + text)
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index < 1 or index > count:
+        raise ValueError('Shard should be between 1/N and N/N: ' + text)
+    return index, count
+
+# CRC32 of the Central Index Key: stable across machines and Python versions (unlike hash())
+
+def shard_of(cik, count):
+    return zlib.crc32(str(int(cik)).encode('ascii')) % count + 1
+
+def select_shard(master_index_df, shard):
+    if shard is None:
+        return master_index_df
+    index, count = shard
+    cik_shard = {cik: shard_of(cik, count) for cik in master_index_df['CIK'].unique()}
+    return master_index_df[master_index_df['CIK'].map(cik_shard) == index]
+
+# Used for all per-shard file names (manifest, job ledger), empty without sharding
+
+def shard_suffix(shard):
+    if shard is None:
+        return ''
+    return '_shard{0}of{1}'.format(shard[0], shard[1])
+
+###############################################################################
+# Manifest of the completed files of a node: relative path (CIK/accession.txt) and size in bytes
+# Written to a temporary file first and renamed, the merge step never reads a half-written manifest
+
+def manifest_path(directory, shard):
+    return directory + manifest_prefix + shard_suffix(shard) + '.csv'
+
+def write_manifest(directory, shard, files):
+    rows = []
+    for file in files:
+        if document_exists(directory, file):
+            rows.append((file, document_size(directory, file)))
+    manifest_df = pd.DataFrame(rows, columns = manifest_columns)
+    path = manifest_path(directory, shard)
+    manifest_df.to_csv(path + '.tmp', index = False)
+    os.replace(path + '.tmp', path)
+    return manifest_df.shape[0]
+
+###############################################################################
+# Copies the loose files of the node directories into output_dir
+
+def copy_files(merged_df, output_dir):
+    for file, size, directory in zip(merged_df['File'], merged_df['Size'], merged_df['Directory']):
+        if os.path.abspath(directory) == os.path.abspath(output_dir):
+            continue
+        target = output_dir + file
+        # Files already copied by an earlier merge are skipped
+        if os.path.isfile(target) and os.path.getsize(target) == size:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok = True)
+        shutil.copy2(directory + file, target + '.tmp')
+        os.replace(target + '.tmp', target)
+
+###############################################################################
+# Below function copies the files listed in the manifests of the node directories into output_dir and writes the combined manifest
+# A file completed by more than one node is taken from the last directory given
+# Packed node directories (see pack_store.py) are merged record by record into a packed output directory, by CIK
+# Returns the combined manifest and the shards that did not deliver a manifest
+
+def merge_shards(node_directories, output_dir):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    manifest_dfs = []
+    shards_found = set()
+    for directory in node_directories:
+        for path in sorted(glob.glob(directory + manifest_prefix + '_shard*of*.csv')):
+            match = re.search('_shard(\\d+)of(\\d+)\\.csv$', path)
+            shards_found.add((int(match.group(1)), int(match.group(2))))
+            manifest_df = pd.read_csv(path, sep = ',')
+            manifest_df['Directory'] = directory
+            manifest_dfs.append(manifest_df)
+
+    if len(manifest_dfs) == 0:
+        return pd.DataFrame(columns = manifest_columns), []
+
+    merged_df = pd.concat(manifest_dfs, ignore_index = True).drop_duplicates(subset = ['File'], keep = 'last')
+
+    if any(is_packed(directory) for directory in node_directories) or is_packed(output_dir):
+        with PackWriter(output_dir) as writer:
+            if writer.by != 'cik':
+                raise ValueError('Packs by year are merged with pack_store.py: ' + output_dir)
+            for file, directory in zip(merged_df['File'], merged_df['Directory']):
+                if os.path.abspath(directory) == os.path.abspath(output_dir) or document_exists(output_dir, file):
+                    continue
+                reader = pack_reader(directory)
+                if reader is None:
+                    with open(directory + file, 'rb') as f:
+                        writer.write(file, f.read())
+                else:
+                    writer.write(file, reader.read(file))
+    else:
+        copy_files(merged_df, output_dir)
+
+    merged_df = merged_df[manifest_columns].sort_values(by = ['File'])
+    merged_df.to_csv(output_dir + manifest_prefix + '.csv', index = False)
+
+    # All shards should come from the same split, every shard from 1 to N should be present
+    missing_shards = []
+    for count in set(count for (index, count) in shards_found):
+        missing_shards.extend((index, count) for index in range(1, count + 1) if (index, count) not in shards_found)
+    return merged_df, missing_shards
+
+###############################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Merge the outputs and manifests of the shards')
+    parser.add_argument('output', help = 'merged output directory, e.g. ./mda_extract/')
+    parser.add_argument('nodes', nargs = '+', help = 'output directories of the nodes')
+    args = parser.parse_args()
+
+    node_directories = [os.path.join(directory, '') for directory in args.nodes]
+    merged_df, missing_shards = merge_shards(node_directories, os.path.join(args.output, ''))
+
+    print('Files in merged manifest: ', merged_df.shape[0])
+    for index, count in missing_shards:
+        print('Missing shard {0}/{1}'.format(index, count))
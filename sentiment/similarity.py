@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the TF-IDF and cosine similarity calculations of cosine_similarity.py. Only the pairs of filings that are actually needed are scored (consecutive filings or filings a given number of years apart) instead of full similarity matrices. The term counts either come from a vectorizer over the whole corpus or from the tokenized corpus (see corpus_store.py).
+"""
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.preprocessing import normalize
+
+from corpus_store import document_tokens
+
+###############################################################################
+# Term counts of a list of filings (rows) over the corpus vocabulary (columns)
+# Same input as the TfidfVectorizer in cosine_similarity.py: words of two characters or more, empty extracts count as the word 'empty'
+
+def tfidf_input_counts(corpus, files):
+    vocabulary_size = len(corpus['vocabulary'])
+    # The word 'empty' might not occur in any extract, in that case it gets an extra column
+    empty_id = corpus['vocabulary_index'].get('empty', vocabulary_size)
+
+    token_arrays = []
+    for file in files:
+        if bool(corpus['documents'].loc[file, 'Empty']):
+            token_arrays.append(np.array([empty_id], dtype = np.int64))
+        else:
+            tokens = document_tokens(corpus, file)
+            token_arrays.append(tokens[corpus['word_lengths'][tokens] > 1].astype(np.int64))
+
+    indptr = np.cumsum([0] + [len(tokens) for tokens in token_arrays])
+    indices = np.concatenate(token_arrays) if len(token_arrays) > 0 else np.zeros(0, dtype = np.int64)
+    counts = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape = (len(files), vocabulary_size + 1))
+    counts.sum_duplicates()
+    return counts
+
+# Term frequency-inverse document frequency weighing with the defaults of TfidfVectorizer (smooth IDF, L2 normalization)
+# https://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.TfidfTransformer.html
+
+def tfidf_matrix(counts):
+    return TfidfTransformer().fit_transform(counts).tocsr()
+
+# Cosine similarity of selected pairs of rows: the rows are L2-normalized, so it is the dot product of both rows
+
+def pair_similarity(tfidf, first_rows, second_rows):
+    if len(first_rows) == 0:
+        return np.zeros(0)
+    return np.asarray(tfidf[first_rows].multiply(tfidf[second_rows]).sum(axis = 1)).ravel()
+
+###############################################################################
+# Batched version for all CIKs at once
+# The rows are sorted by group (CIK) and filing date, group_ids holds the group number of every row
+
+# TF-IDF with a separate IDF per group, equal to fitting one TfidfVectorizer per CIK
+# The document frequency of every non-zero entry is the number of rows in the same group with that column
+
+def grouped_tfidf_matrix(counts, group_ids):
+    counts = sparse.csr_matrix(counts, dtype = np.float64)
+    counts.sum_duplicates()
+    group_ids = np.asarray(group_ids, dtype = np.int64)
+
+    row_ids = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    entry_groups = group_ids[row_ids]
+    keys = entry_groups * counts.shape[1] + counts.indices
+    unique_keys, key_index, document_frequency = np.unique(keys, return_inverse = True, return_counts = True)
+
+    # Smooth IDF as in scikit-learn: ln((1 + n) / (1 + df)) + 1
+    group_sizes = np.bincount(group_ids)
+    idf = np.log((1.0 + group_sizes[entry_groups]) / (1.0 + document_frequency[key_index])) + 1.0
+
+    tfidf = sparse.csr_matrix((counts.data * idf, counts.indices.copy(), counts.indptr.copy()), shape = counts.shape)
+    return normalize(tfidf, norm = 'l2')
+
+# Pairs of rows (t - lag, t) within the same group
+
+def lagged_pairs(group_ids, lag):
+    group_ids = np.asarray(group_ids)
+    second_rows = np.arange(lag, len(group_ids))
+    first_rows = second_rows - lag
+    same_group = group_ids[first_rows] == group_ids[second_rows]
+    return first_rows[same_group], second_rows[same_group]
+
+###############################################################################
+# Corpus-wide IDF: fitted once over all filings (or a window of filing years) and stored with its vocabulary
+# Reusing it only requires a transform, and the similarity scores are on the same scale for all companies
+
+# rows selects the filings used for the fit, words that do not occur in those filings get an IDF of 0 (i.e. they are ignored)
+
+def fit_idf(counts, rows=None):
+    counts = sparse.csr_matrix(counts)
+    counts.sum_duplicates()
+    if rows is not None:
+        counts = counts[rows]
+    document_frequency = np.bincount(counts.indices, minlength = counts.shape[1])
+    idf = np.zeros(counts.shape[1])
+    fitted = document_frequency > 0
+    idf[fitted] = np.log((1.0 + counts.shape[0]) / (1.0 + document_frequency[fitted])) + 1.0
+    return idf
+
+def save_idf(file, vocabulary, idf):
+    fitted = idf > 0
+    np.savez(file, vocabulary = np.array(vocabulary, dtype = str)[fitted], idf = idf[fitted])
+
+def load_idf(file):
+    with np.load(file) as idf_file:
+        return [str(word) for word in idf_file['vocabulary']], idf_file['idf']
+
+def apply_idf(counts, idf):
+    tfidf = sparse.csr_matrix(counts, dtype = np.float64) @ sparse.diags(idf)
+    return normalize(tfidf.tocsr(), norm = 'l2')
+
+# Stored IDF aligned with the columns of tfidf_input_counts() for the tokenized corpus
+
+def corpus_idf_vector(idf_vocabulary, idf, corpus):
+    vocabulary_size = len(corpus['vocabulary'])
+    aligned_idf = np.zeros(vocabulary_size + 1)
+    for word, value in zip(idf_vocabulary, idf):
+        token_id = corpus['vocabulary_index'].get(word)
+        if token_id is not None:
+            aligned_idf[token_id] = value
+        elif word == 'empty':
+            aligned_idf[vocabulary_size] = value
+    return aligned_idf
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the text clean up of the 10-K filings shared by download_clean_10k.py and extract_mda.py (and its parallel version). The regular expressions are compiled once and steps are merged or replaced where the result is guaranteed to be the same (a translation table for deleting digits, one substitution for non-breaking spaces and double spaces, plain string replacements for literals). The output is identical to the original chain of re.sub calls, see text_normalization_check.py for the regression check.
+
+The attachments, the lines of the table of contents and the item references are found with linear scans instead of their patterns. On malformed filings (few line breaks, many <TYPE> tags, long runs of letters) the patterns are retried from every candidate over the rest of the filing, which is quadratic and stalled a worker for minutes on a single filing. The scans find exactly the same matches; the patterns are kept as their definition.
+"""
+
+import re
+import sys
+
+###############################################################################
+# Clean up of the HTML leftovers (download_clean_10k.py and the first part of the MD&A extraction)
+
+# Remove HTML tags
+html_tag = re.compile('<.*?>')
+# Replace non-breaking spaces (HTML leftovers) and double spaces in one go: every run of spaces and non-breaking spaces becomes one space
+# A single space is not matched, which would be a replacement by itself
+nbsp_spaces = re.compile('&nbsp;(?:&nbsp;| )*| (?:&nbsp;| )+')
+# Remove all HTML entities: https://developer.mozilla.org/en-US/docs/Glossary/Entity
+# and https://stackoverflow.com/questions/26127775/remove-html-entities-and-extract-text-content-using-regex
+html_entity = re.compile('/&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});')
+# Clean up signatures
+signature = re.compile('\\/s\\/\\s|\\/s\\/')
+# Final cleaning (keep words with slashes, ampersands and dashes)
+special_characters = re.compile('[^0-9a-zA-Z][\\s\\t]+?&-\\/\'')
+# Clean up previous line
+numeric_entity = re.compile('&#\\d*;')
+empty_lines = re.compile('\\n\\s*\\n')
+
+# Most patterns can only match if a fixed piece of text is present, checking for it is much cheaper than a pass of the regular expression
+
+def clean_markup(data):
+    # Remove all newlines and start a new line after every tag, so that a tag never spans multiple lines
+    # Both are plain string replacements (much faster than re.sub for literals)
+    data = data.replace('\n', ' ').replace('>', '>\n')
+    if '<' in data:
+        data = html_tag.sub('', data)
+    data = nbsp_spaces.sub(' ', data)
+    if '/&' in data:
+        data = html_entity.sub('', data)
+    if '/s/' in data:
+        data = signature.sub('', data)
+    if "&-/'" in data:
+        data = special_characters.sub('', data)
+    if '&#' in data:
+        data = numeric_entity.sub('', data)
+    data = empty_lines.sub('\n', data)
+    return data
+
+###############################################################################
+# Clean up of the full filing before locating the MD&A section
+
+# Remove all kinds of attachments except the core 10-K or 10-K405
+attachments = re.compile('<TYPE>(?!10-K|10-K405)[\\S\\s]*<\\/TEXT>')
+
+# The greedy pattern removes everything from the first other <TYPE> up to the last </TEXT> after it (if there is one)
+# Two searches find the same span, the pattern went to the end of the filing and back for every other <TYPE>
+other_type = re.compile('<TYPE>(?!10-K)')
+
+def remove_attachments(data):
+    m = other_type.search(data)
+    if m is None:
+        return data
+    end = data.rfind('</TEXT>')
+    if end < m.end():
+        return data
+    return data[:m.start()] + data[end+len('</TEXT>'):]
+
+def clean_filing(data):
+    if '<TYPE>' in data:
+        data = remove_attachments(data)
+    # Remove HTML tags and pre-processing (second time as we had leftovers following the download for <0.1% of the dataset)
+    data = clean_markup(data)
+    return data.replace('\r', '\n')
+
+# Used in mda_extract_regex_change: remove carriage returns and join the word Item when split over two lines
+# As the carriage returns are removed first, only the newline variants need to be joined
+item_split = re.compile('I\\ntem|It\\nem|Ite\\nm', flags=re.I)
+
+def join_split_items(data):
+    data = data.replace('\r', '')
+    return item_split.sub('Item', data)
+
+# Remove the lines of the table of contents (item headers followed by dots and a page number)
+toc_line = re.compile('Ite[m\\s:]*\\d\\.*[\\S ]*\\.+"*\\n', flags=re.I)
+
+# Remove references to items: the five words before the word Item are replaced by the last one of them
+item_reference = re.compile('([a-zA-Z\\"\'-]+ +){5}Ite[m\\s:]*\\d', flags=re.I)
+
+# The bytes scans run on the filing as it is on disk, where the text mode reads it with universal newlines: there a line ends with \r\n, \r or \n
+toc_line_bytes = re.compile(b'Ite[m\\s:]*\\d\\.*[\\S ]*\\.+"*(?:\\r\\n?|\\n)', flags=re.I)
+
+# The word Item split over two lines, as joined by join_split_items() (Ite\nm is already taken by Ite[m\s:]*), on bytes as on disk
+split_item_word = b'(?:I(?:\\r\\n?|\\n)t|It(?:\\r\\n?|\\n)?)e'
+
+# item_reference on bytes for the regex change variant, which joins the split word Item first
+split_item_reference = re.compile(b'([a-zA-Z\\"\'-]+ +){5}' + split_item_word + b'[m\\s:]*\\d', flags=re.I)
+
+# Pieces of the two patterns used by the scans, for str and for bytes (memory-mapped MD&A extraction)
+# item_head: the word Item up to the item number, split_item_head: the same with the word Item split over two lines (bytes only), line_break: first character not taken by [\S ]*
+# words_back: the five words of an item reference on the reversed text before the item header (the first group is the fifth word),
+# some_words_back: up to four of them, to tell whether a reversed window was too short
+scan_patterns = {str: {'item_head': re.compile('Ite[m\\s:]*\\d', flags=re.I),
+                       'line_break': re.compile('[^\\S ]'),
+                       'words_back': re.compile('( +[a-zA-Z\\"\'-]+)(?: +[a-zA-Z\\"\'-]+){4}', flags=re.I),
+                       'some_words_back': re.compile('(?: +[a-zA-Z\\"\'-]+){0,4} *', flags=re.I)},
+                 bytes: {'item_head': re.compile(b'Ite[m\\s:]*\\d', flags=re.I),
+                         'split_item_head': re.compile(split_item_word + b'[m\\s:]*\\d', flags=re.I),
+                         'line_break': re.compile(b'[^\\S ]'),
+                         'words_back': re.compile(b'( +[a-zA-Z\\"\'-]+)(?: +[a-zA-Z\\"\'-]+){4}', flags=re.I),
+                         'some_words_back': re.compile(b'(?: +[a-zA-Z\\"\'-]+){0,4} *', flags=re.I)}}
+
+# Characters before an item header taken at first to look for the five words, doubled as long as the words might go on beyond them
+reference_window = 256
+
+def scan_type(data):
+    return str if isinstance(data, str) else bytes
+
+# Below function returns the starts and ends of the matches of toc_line (the same as toc_line.finditer), of toc_line_bytes on bytes
+# A match is an item header whose line (up to the first whitespace other than a space) ends with dots, optional quotes and a newline
+# The end of a line and the dots before it are looked up once per line instead of once per item header on that line
+
+def toc_line_spans(data):
+    patterns = scan_patterns[scan_type(data)]
+    newline, carriage_return, dot, quote = ('\n', None, '.', '"') if scan_type(data) is str else (b'\n', b'\r', b'.', b'"')
+    starts = []
+    ends = []
+    position = 0
+    line_end = -1
+    next_line = -1
+    last_dot = -1
+    for m in patterns['item_head'].finditer(data):
+        if m.start() < position:
+            continue
+        if m.end() > line_end:
+            line_break = patterns['line_break'].search(data, m.end())
+            line_end = line_break.start() if line_break is not None else len(data)
+            # Start of the next line, after \r\n or \r on bytes
+            next_line = line_end + 1
+            if data[line_end:line_end+1] == carriage_return:
+                next_line += data[next_line:next_line+1] == newline
+            # Position of the dot before the quotes at the end of the line, -1 if the line does not end that way
+            last_dot = -1
+            if data[line_end:line_end+1] in (newline, carriage_return):
+                index = line_end - 1
+                while index >= 0 and data[index:index+1] == quote:
+                    index -= 1
+                if index >= 0 and data[index:index+1] == dot:
+                    last_dot = index
+        if last_dot >= m.end():
+            starts.append(m.start())
+            ends.append(next_line)
+            position = next_line
+    return starts, ends
+
+def remove_toc_lines(data):
+    starts, ends = toc_line_spans(data)
+    if len(starts) == 0:
+        return data
+    pieces = []
+    position = 0
+    for start, end in zip(starts, ends):
+        pieces.append(data[position:start])
+        position = end
+    pieces.append(data[position:])
+    return data[:0].join(pieces)
+
+# Below function returns the start of the five words before an item header and the start of the fifth one (the word kept), None if there are no five words
+# The words are separated by spaces only and the first one is a whole word, as for item_reference
+# They are matched backwards on the reversed text before the header, the window is doubled while the words or spaces reach its edge
+
+def reference_words(data, head_start, patterns):
+    size = reference_window
+    while True:
+        low = max(0, head_start - size)
+        window = data[low:head_start][::-1]
+        m = patterns['words_back'].match(window)
+        if m is not None and (m.end() < len(window) or low == 0):
+            return head_start - m.end(), head_start - m.end(1)
+        if m is None and (patterns['some_words_back'].match(window).end() < len(window) or low == 0):
+            return None
+        size *= 2
+
+# Below function returns the matches of item_reference (the same as item_reference.finditer) as (start, end, start and end of the fifth word with its spaces)
+# With split_items (bytes only) the word Item may be split over two lines, the matches are those of split_item_reference
+# The pattern was tried from every word (and every letter of a long run of letters), the scan only starts from the item headers, which are few
+# The words before a header can never reach back into the previous match, that one ends with the item number
+
+def item_reference_matches(data, split_items=False):
+    patterns = scan_patterns[scan_type(data)]
+    matches = []
+    position = 0
+    for head in patterns['split_item_head' if split_items else 'item_head'].finditer(data):
+        if head.start() < position:
+            continue
+        words = reference_words(data, head.start(), patterns)
+        if words is not None:
+            matches.append((words[0], head.end(), words[1], head.start()))
+            position = head.end()
+    return matches
+
+def item_reference_spans(data, split_items=False):
+    matches = item_reference_matches(data, split_items)
+    return [match[0] for match in matches], [match[1] for match in matches]
+
+def remove_item_references(data):
+    matches = item_reference_matches(data)
+    if len(matches) == 0:
+        return data
+    pieces = []
+    position = 0
+    for start, end, word_start, word_end in matches:
+        pieces.append(data[position:start])
+        pieces.append(data[word_start:word_end])
+        position = end
+    pieces.append(data[position:])
+    return data[:0].join(pieces)
+
+###############################################################################
+# Clean up of the extracted MD&A section
+
+# As we are looking for textual changes, we are going to remove all numbers
+# Deleting characters with a translation table is a lot faster than re.sub('\d', ...)
+# The table holds all Unicode decimal digits, exactly the characters matched by \d
+digit_table = {code: None for code in range(sys.maxunicode + 1) if chr(code).isdecimal()}
+double_spaces = re.compile(' {2,}')
+# Parens and possessives, "'s" is tried before "'" in the original alternation
+possessives_parens = re.compile("'s?|[()]")
+# Leftovers from Item 7A
+trailing_signs = re.compile('[%|$|+|-]\\n')
+trailing_signs_dot = re.compile('[+|-]\\.\\n')
+
+def finalize_mda(data):
+    data = data.translate(digit_table)
+    # Final replacement of double spaces
+    data = double_spaces.sub(' ', data)
+
+    # Finally we prepare the output for sentiment analysis based on the Loughran McDonaldMaster Dictionary
+    # by removing parens and possessives as well as leftovers from Item 7A
+    # https://drive.google.com/file/d/0B4niqV00F3msQ3lVeGpKSEg4QUU/view
+    data = possessives_parens.sub('', data)
+    data = data.replace('\n.', '')
+    data = trailing_signs.sub('', data)
+    data = trailing_signs_dot.sub('', data)
+    return data.replace('\n\n', '')
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+This script verifies that text_normalization.py gives exactly the same output as the original chains of regular expressions of download_clean_10k.py and extract_mda.py. The fixtures below are small pieces of filings for the cases the rewrites have to get right (non-breaking spaces fused with spaces, items split over two lines, attachments, lines of the table of contents and item references, also with \\r\\n and \\r line ends and split over two lines); they are checked as they are and in random combinations, and the scans are also checked on bytes as used by the memory-mapped MD&A extraction. Files passed as arguments are checked as well. Run it after any change to the clean up steps.
+"""
+
+import re
+import sys
+import random
+
+import text_normalization as tn
+
+###############################################################################
+# Number of random combinations of the fixtures and their length (in fixtures)
+combinations = 2000
+combination_length = 8
+random_seed = 6242
+
+###############################################################################
+# Original chains (reference), kept exactly as they were written
+
+def reference_clean_markup(data):
+    data = re.sub('\n', ' ', data)
+    data = re.sub('>', '>\n', data)
+    data = re.sub('<.*?>','', data)
+    data = re.sub('&nbsp;', ' ', data)
+    data = re.sub(' {2,}', ' ', data)
+    data = re.sub('/&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});','', data)
+    data = re.sub('\/s\/\s|\/s\/','', data)
+    data = re.sub('[^0-9a-zA-Z][\s\t]+?&-\/\'', '', data)
+    data = re.sub('&#\d*;','', data)
+    data = re.sub('\n\s*\n','\n', data)
+    return data
+
+def reference_clean_filing(data):
+    data = re.sub('<TYPE>(?!10-K|10-K405)[\S\s]*<\/TEXT>', '', data)
+    data = reference_clean_markup(data)
+    data = re.sub('\r', '\n', data)
+    return data
+
+def reference_join_split_items(data):
+    data = re.sub('\r', '', data )
+    data = re.sub('I\r\ntem', 'Item', data, flags=re.I)
+    data = re.sub('It\r\nem', 'Item', data, flags=re.I)
+    data = re.sub('Ite\r\nm', 'Item', data, flags=re.I)
+
+    data = re.sub('I\ntem', 'Item', data, flags=re.I)
+    data = re.sub('It\nem', 'Item', data, flags=re.I)
+    data = re.sub('Ite\nm', 'Item', data, flags=re.I)
+    return data
+
+def reference_remove_toc_lines(data):
+    return re.sub('Ite[m\s:]*\d\.*[\S ]*\.+"*\n', '', data, flags=re.I)
+
+def reference_remove_item_references(data):
+    return re.sub('([a-zA-Z\"\'-]+ +){5}Ite[m\s:]*\d', r'\1', data, flags=re.I)
+
+def reference_finalize_mda(data):
+    data = re.sub('\d','', data)
+    data = re.sub(' {2,}', ' ', data)
+    data = re.sub("'s|'|\(|\)", '', data)
+    data = re.sub('\n\.', '', data)
+    data = re.sub('[%|$|+|-]\n', '', data)
+    data = re.sub('[+|-]\.\n', '', data)
+    data = re.sub('\n\n', '', data)
+    return data
+
+# Pairs of (name, reference, new implementation)
+checks = [('clean_markup', reference_clean_markup, tn.clean_markup),
+          ('clean_filing', reference_clean_filing, tn.clean_filing),
+          ('join_split_items', reference_join_split_items, tn.join_split_items),
+          ('remove_toc_lines', reference_remove_toc_lines, tn.remove_toc_lines),
+          ('remove_item_references', reference_remove_item_references, tn.remove_item_references),
+          ('finalize_mda', reference_finalize_mda, tn.finalize_mda)]
+
+# The spans found by the scans on str and on bytes (memory-mapped MD&A extraction) against the patterns, as (name, str pattern, bytes pattern, scan)
+# On bytes the lines end with \r\n, \r or \n (toc_line_bytes) and the regex change variant accepts the word Item split over two lines (split_item_reference)
+def encoded_pattern(pattern):
+    return re.compile(pattern.pattern.encode('utf-8'), flags=pattern.flags & ~re.U)
+
+span_checks = [('toc_line_spans', tn.toc_line, tn.toc_line_bytes, tn.toc_line_spans),
+               ('item_reference_spans', tn.item_reference, encoded_pattern(tn.item_reference), tn.item_reference_spans),
+               ('item_reference_spans (split items)', None, tn.split_item_reference, lambda data: tn.item_reference_spans(data, split_items = True))]
+
+###############################################################################
+# Fixtures
+
+fixtures = [
+    # Non-breaking spaces fused with the spaces around them
+    'Net&nbsp;sales&nbsp;&nbsp;increased',
+    'total &nbsp; &nbsp;revenue',
+    '&nbsp;',
+    ' &nbsp;',
+    '&nbsp; ',
+    'a  &nbsp;&nbsp;  b',
+    '&nbsp;&nbsp;&nbsp;\n&nbsp;',
+    '&amp;nbsp; &NBSP;',
+    # Markup, entities and signatures
+    '<P ALIGN="center"><B>Item 7.</B></P>',
+    '<TD>\n<FONT SIZE=2>&#151;</FONT></TD>',
+    'a/&amp;b /&#160; /&#x1F;',
+    '/s/ John Smith /s/Jane Doe',
+    'x &-/\' y\n\n  \n\nz',
+    # Items split over two lines
+    'I\r\ntem 7',
+    'It\nem 7A',
+    'ITE\r\nM 8',
+    'i\ntem\r\n7',
+    'Ite\r\r\nm 7',
+    # Attachments
+    '<TYPE>10-K\n<TEXT>annual report</TEXT>\n',
+    '<TYPE>10-K405\n<TEXT>annual report</TEXT>\n',
+    '<TYPE>EX-21\n<TEXT>subsidiaries</TEXT>\n',
+    '<TYPE>EX-27\n<TEXT>financial data',
+    '</TEXT>\n',
+    '<TYPE>10-Q\n',
+    # Lines of the table of contents
+    'Item 7. Management\'s Discussion and Analysis ........ 12\n',
+    'ITEM 7A: Quantitative and Qualitative Disclosures.....\n',
+    'Item 8 Financial Statements ...."\n',
+    'Item 7 Item 8 Item 9 ....."""\n',
+    'Item 7. Results of operations\n',
+    'Item\n7..\n',
+    'Item 1.\tBusiness ...\n',
+    'Items 7 and 8 .\n',
+    'Item 7. Management\'s Discussion and Analysis ........ 12\r\n',
+    'ITEM 8 Financial Statements ...""\r',
+    'Item 7 ....\r\r\n',
+    'Item 7A ....\t\r\n',
+    # Item references
+    'as described in more detail in Item 7',
+    'see the discussion under the heading of Item 7A',
+    'the risk "factors" described in part I, Item 1A',
+    'of-the company\'s "annual report" on Item 8',
+    'one two three four Item 7',
+    'one  two   three four five    Item 7',
+    'one\ttwo three four five six Item 7',
+    'in the following section Item 7 Item 8 Item 9',
+    'Item 7 one two three four five Item 8',
+    ' '.join(['word'] * 80) + ' Item 7',
+    'a' * 600 + ' b c d e Item 7',
+    ' ' * 600 + 'b c d e f Item 7',
+    'abcde ' * 60 + 'Item',
+    'as described in more detail in I\r\ntem 7',
+    'as described in more detail in It\rem 7A',
+    'as described in more detail in It\nem\r\n8',
+    'as described in more detail in I\r\nt\nem 7',
+    # Clean up of the MD&A section
+    'The Company\'s sales (in millions) were $1,234 in 2019.\n.',
+    'increase of 10%\ndecrease -\n+.\n\n',
+    'units٣٤ and １２',
+]
+
+###############################################################################
+# Returns the number of differences
+
+def check_text(data, name=''):
+    differences = 0
+    for check, reference, implementation in checks:
+        if implementation(data) != reference(data):
+            differences += 1
+            print('Difference in {0} for {1}'.format(check, name))
+    for encoded in [data, data.encode('utf-8')]:
+        for check, str_pattern, bytes_pattern, implementation in span_checks:
+            pattern = bytes_pattern if isinstance(encoded, bytes) else str_pattern
+            if pattern is None:
+                continue
+            matches = list(pattern.finditer(encoded))
+            if implementation(encoded) != ([m.start() for m in matches], [m.end() for m in matches]):
+                differences += 1
+                print('Difference in {0} ({1}) for {2}'.format(check, type(encoded).__name__, name))
+    return differences
+
+def fixture_combinations(count, length):
+    generator = random.Random(random_seed)
+    separators = ['', ' ', '\n', '\r\n', '\r']
+    for index in range(count):
+        pieces = generator.choices(fixtures, k=generator.randint(2, length))
+        yield ''.join(piece + generator.choice(separators) for piece in pieces)
+
+if __name__ == '__main__':
+    differences = 0
+    checked = 0
+    for index, data in enumerate(fixtures):
+        differences += check_text(data, 'fixture {0}: {1!r}'.format(index, data[:60]))
+        checked += 1
+    for index, data in enumerate(fixture_combinations(combinations, combination_length)):
+        differences += check_text(data, 'combination {0}: {1!r}'.format(index, data[:60]))
+        checked += 1
+
+    for file in sys.argv[1:]:
+        with open(file, 'r', encoding = 'latin-1', newline = '') as f:
+            data = f.read()
+        differences += check_text(data, file)
+        checked += 1
+
+    print('Texts checked: {0}, differences: {1}'.format(checked, differences))
+    sys.exit(1 if differences > 0 else 0)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+This script computes the full word counts per Central Index Key, per year and per Central Index Key per year in one job. Every MD&A extract is tokenized once into a sparse document-term matrix (stored in mda_word_counts.npz and reused as long as the master index and the extracts do not change); the counts of a CIK, a year or a CIK-year are sums of its rows. The outputs are the same logs and JSON files as full_word_count_cik.py, full_word_count_year.py and full_word_count_cik_year.py; the CIK-year counts of the filings of that year only (--per-year) go to full_word_count_cik_year_sum_stats. Optionally only the most frequent words of every group are kept in the JSON files (--top-k) to keep them small enough for the visualization.
+"""
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+import argparse
+import os
+import re
+from tqdm import tqdm
+
+from lexicon import load_lexicon
+from master_index import load_master_index, group_bounds, group_ids
+from pack_store import open_document, document_version
+from results_io import ResultsWriter
+
+###############################################################################
+# We are taking the output of the extract_mda script.
+
+input_directory = './mda_extract/'
+output_directory = './results/'
+log_directory = './logs/'
+master_index_df = 'master_index/master_index_filtered.csv'
+dictionary_directory = './master_dictionary/'
+
+counts_file = './mda_word_counts.npz'
+
+# Same outputs as the full_word_count_*.py scripts (.log and .json)
+# The CIK-year counts of the filings of that year only are not an output of those scripts and have a name of their own
+word_count_files = {'cik': 'full_word_count_cik_stats',
+                    'year': 'full_word_count_year_stats',
+                    'cik_year': 'full_word_count_cik_year_stats',
+                    'cik_year_sum': 'full_word_count_cik_year_sum_stats'}
+
+# We change the vectorizer to take three-letter words
+token_pattern = r'(?u)\b\w\w\w+\b'
+
+# Only the top_k most frequent words of every group go into the JSON files (None keeps all words), the logs always have all words
+top_k = None
+
+# full_word_count_cik_year.py does not start a new corpus per year: the counts of a year include the earlier filings of the CIK
+# Set to False to count the filings of that year only (written to full_word_count_cik_year_sum_stats instead)
+cik_year_cumulative = True
+
+###############################################################################
+# Term counts per filing, in the order of the master index (by CIK and filing date)
+
+def read_extracts(files, readable, nonempty):
+    with tqdm(total=len(files)) as pbar:
+        for index, file in enumerate(files):
+            pbar.update(1)
+            try:
+                with open_document(input_directory, file) as f:
+                    # Had some strange results coming from the MD&A formatting, removing underscores explicitly
+                    data = re.sub('_', '', f.read().lower())
+            except Exception as e:
+                print(e)
+                readable[index] = False
+                data = ''
+            nonempty[index] = data != ''
+            yield data
+
+def count_words(files, stop_words):
+    readable = np.ones(len(files), dtype = bool)
+    nonempty = np.zeros(len(files), dtype = bool)
+    vectorizer = CountVectorizer(stop_words = stop_words, token_pattern = token_pattern, dtype = np.int32)
+    try:
+        counts = vectorizer.fit_transform(read_extracts(files, readable, nonempty))
+        vocabulary = vectorizer.get_feature_names_out()
+    except ValueError:
+        # No words at all (e.g. only empty extracts)
+        counts = sparse.csr_matrix((len(files), 0), dtype = np.int32)
+        vocabulary = np.array([], dtype = str)
+    return {'files': np.array(files, dtype = str), 'vocabulary': np.array(vocabulary, dtype = str),
+            'counts': sparse.csr_matrix(counts), 'readable': readable, 'nonempty': nonempty}
+
+###############################################################################
+# The counts are stored as the arrays of the sparse matrix, written to a temporary file first and renamed
+# Along with them the size and version of every extract when it was counted (see document_version() in pack_store.py)
+
+def save_word_counts(file, word_counts):
+    counts = word_counts['counts']
+    temporary_file = file[:-len('.npz')] + '.tmp.npz'
+    np.savez(temporary_file, files = word_counts['files'], vocabulary = word_counts['vocabulary'],
+             readable = word_counts['readable'], nonempty = word_counts['nonempty'], versions = word_counts['versions'],
+             data = counts.data, indices = counts.indices, indptr = counts.indptr, shape = np.array(counts.shape))
+    os.replace(temporary_file, file)
+
+def load_word_counts(file):
+    with np.load(file) as f:
+        counts = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape = tuple(f['shape']))
+        # Counts stored without the versions are always counted again
+        versions = f['versions'] if 'versions' in f.files else None
+        return {'files': f['files'], 'vocabulary': f['vocabulary'], 'counts': counts,
+                'readable': f['readable'], 'nonempty': f['nonempty'], 'versions': versions}
+
+def extract_versions(files):
+    return np.array([document_version(input_directory, file) for file in files], dtype = np.int64).reshape(-1, 2)
+
+# The stored counts are only reused for exactly the same filings in the same order, with none of the extracts written again since (e.g. by a new extraction)
+# The versions are taken before the extracts are read, an extract written during the count is counted again the next time
+
+def word_counts_for(master_index_df, stop_words, file=counts_file, recount=False):
+    files = list(master_index_df['File'])
+    versions = extract_versions(files)
+    if not recount and os.path.isfile(file):
+        word_counts = load_word_counts(file)
+        if word_counts['files'].tolist() == files and word_counts['versions'] is not None and np.array_equal(word_counts['versions'], versions):
+            return word_counts
+    word_counts = count_words(files, stop_words)
+    word_counts['versions'] = versions
+    save_word_counts(file, word_counts)
+    return word_counts
+
+###############################################################################
+# Group reductions: a sparse indicator matrix (groups x filings) times the document-term matrix gives the counts per group
+
+def group_sums(counts, group_index, number_of_groups):
+    indicator = sparse.csr_matrix((np.ones(len(group_index), dtype = np.int32), (group_index, np.arange(len(group_index)))),
+                                  shape = (number_of_groups, len(group_index)))
+    sums = sparse.csr_matrix(indicator @ counts)
+    sums.sort_indices()
+    return sums
+
+# Running totals within every group (filing i gets the sum of the filings of its group up to and including i), the rows are sorted by group
+
+def cumulative_sums(counts, bounds):
+    rows = []
+    columns = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        lower_rows, lower_columns = np.tril_indices(end - start)
+        rows.append(lower_rows + start)
+        columns.append(lower_columns + start)
+    rows = np.concatenate(rows) if len(rows) > 0 else np.array([], dtype = int)
+    columns = np.concatenate(columns) if len(columns) > 0 else np.array([], dtype = int)
+    lower = sparse.csr_matrix((np.ones(len(rows), dtype = np.int32), (rows, columns)), shape = (counts.shape[0], counts.shape[0]))
+    sums = sparse.csr_matrix(lower @ counts)
+    sums.sort_indices()
+    return sums
+
+# Words and counts of one row, in alphabetical order as get_feature_names()
+
+def row_words(vocabulary, sums, row):
+    start, end = sums.indptr[row], sums.indptr[row + 1]
+    return {vocabulary[index]: int(count) for (index, count) in zip(sums.indices[start:end], sums.data[start:end]) if count > 0}
+
+def top_words(words, top_k):
+    if top_k is None or len(words) <= top_k:
+        return words
+    # Most frequent words first, ties in alphabetical order; the JSON keeps the alphabetical order
+    kept = set(sorted(words, key = lambda word: -words[word])[:top_k])
+    return {word: count for (word, count) in words.items() if word in kept}
+
+###############################################################################
+# Below function writes the logs and results of the three groupings, one record per CIK or year (see results_io.py)
+# Groups without any non-empty extract are left out, as the "Additional logic to eliminate empty MD&A extracts" in the original scripts
+
+def write_word_counts(master_index_df, word_counts, top_k=top_k, cumulative=cik_year_cumulative):
+    vocabulary = word_counts['vocabulary'].tolist()
+    counts = word_counts['counts']
+    nonempty = word_counts['nonempty'].astype(np.int32)
+    cik_list = master_index_df['CIK'].tolist()
+    year_list = master_index_df['Year'].tolist()
+
+    # Per CIK: the master index is sorted by CIK, the groups are consecutive rows
+    cik_bounds = group_bounds(master_index_df, 'cik')
+    cik_index = group_ids(master_index_df, 'cik')
+    sums = group_sums(counts, cik_index, len(cik_bounds) - 1)
+    filled = np.bincount(cik_index, weights = nonempty, minlength = len(cik_bounds) - 1)
+    file_name = word_count_files['cik']
+    with open(log_directory + file_name + '.log', 'w') as statsf, ResultsWriter(output_directory + file_name + '.json') as results_writer:
+        for group, start in enumerate(cik_bounds[:-1]):
+            if filled[group] > 0:
+                cik = cik_list[start]
+                words = row_words(vocabulary, sums, group)
+                for k, v in words.items():
+                    statsf.write(str(cik) + ',' + str(k) + ',' + str(v) +'\n')
+                results_writer.write(str(cik), top_words(words, top_k))
+
+    # Per year
+    years, year_index = np.unique(np.array(year_list, dtype = int), return_inverse = True)
+    sums = group_sums(counts, year_index, len(years))
+    filled = np.bincount(year_index, weights = nonempty, minlength = len(years))
+    file_name = word_count_files['year']
+    with open(log_directory + file_name + '.log', 'w') as statsf, ResultsWriter(output_directory + file_name + '.json') as results_writer:
+        for group, year in enumerate(years):
+            if filled[group] > 0:
+                words = row_words(vocabulary, sums, group)
+                for k, v in words.items():
+                    statsf.write(str(year) + ',' + str(k) + ',' + str(v) +'\n')
+                results_writer.write(str(year), top_words(words, top_k))
+
+    # Per CIK per year: (row of sums, CIK, year) of every result, in order of CIK
+    if cumulative:
+        # One result per filing (the last filing of a year is the one that stays in the JSON file), as full_word_count_cik_year.py
+        sums = cumulative_sums(counts, cik_bounds)
+        running = np.cumsum(nonempty)
+        filled = running - np.repeat(np.append(0, running)[cik_bounds[:-1]], np.diff(cik_bounds))
+        rows = [(row, cik_list[row], year_list[row]) for row in range(len(cik_list)) if filled[row] > 0]
+    else:
+        cik_year_bounds = group_bounds(master_index_df, 'cik_year')
+        sums = group_sums(counts, group_ids(master_index_df, 'cik_year'), len(cik_year_bounds) - 1)
+        filled = np.add.reduceat(nonempty, cik_year_bounds[:-1]) if len(nonempty) > 0 else []
+        rows = [(group, cik_list[start], year_list[start]) for (group, start) in enumerate(cik_year_bounds[:-1]) if filled[group] > 0]
+
+    # Every CIK gets a record, also without any non-empty extract
+    file_name = word_count_files['cik_year' if cumulative else 'cik_year_sum']
+    with open(log_directory + file_name + '.log', 'w') as statsf, ResultsWriter(output_directory + file_name + '.json') as results_writer:
+        position = 0
+        for start in cik_bounds[:-1]:
+            cik = cik_list[start]
+            cik_results = {}
+            while position < len(rows) and rows[position][1] == cik:
+                row, cik, year = rows[position]
+                words = row_words(vocabulary, sums, row)
+                for k, v in words.items():
+                    statsf.write(str(cik) + ',' + str(year) + ',' + str(k) + ',' + str(v) +'\n')
+                cik_results[str(year)] = top_words(words, top_k)
+                position += 1
+            results_writer.write(str(cik), cik_results)
+
+###############################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Full word counts per CIK, per year and per CIK per year')
+    parser.add_argument('--top-k', type = int, default = top_k, help = 'most frequent words per group in the JSON files (default: all)')
+    parser.add_argument('--recount', action = 'store_true', help = 'tokenize the extracts again instead of using ' + counts_file)
+    parser.add_argument('--per-year', action = 'store_true', help = 'CIK-year counts of the filings of that year only, written to ' + word_count_files['cik_year_sum'] + ' instead')
+    args = parser.parse_args()
+
+    master_index_df = load_master_index(master_index_df)
+    lexicon = load_lexicon(dictionary_directory)
+    word_counts = word_counts_for(master_index_df, sorted(lexicon['stop']), counts_file, args.recount)
+
+    # Verify existence of log and output directory and create if not exists
+    for directory in [log_directory, output_directory]:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    write_word_counts(master_index_df, word_counts, args.top_k, cik_year_cumulative and not args.per_year)
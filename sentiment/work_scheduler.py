@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+This module hands out work to a pool of processes in small batches on demand, instead of splitting the list up front into one equal slice per process. Filing sizes and the number of filings per company are very skewed, so with fixed slices one process would still be running long after the others are done. Batches are balanced by the estimated number of bytes (e.g. the file size) and the largest ones go first, so the small ones fill up the end. The throughput of every worker process is reported at the end. Used by extract_mda_parallel.py and download_clean_10k.py.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+###############################################################################
+# A batch holds at most batch_bytes (a larger item gets a batch of its own) and at most batch_items items
+
+batch_bytes = 32*1024*1024
+batch_items = 50
+
+# Number of batches waiting for every worker, the next batch is only submitted when one is done
+batches_per_worker = 2
+
+###############################################################################
+# Below function groups the items into batches, largest items first
+# Returns a list of (items, estimated bytes)
+
+def make_batches(items, sizes, batch_bytes=batch_bytes, batch_items=batch_items):
+    order = sorted(range(len(items)), key=lambda index: sizes[index], reverse=True)
+    batches = []
+    batch = []
+    batch_size = 0
+    for index in order:
+        if len(batch) > 0 and (batch_size + sizes[index] > batch_bytes or len(batch) >= batch_items):
+            batches.append((batch, batch_size))
+            batch = []
+            batch_size = 0
+        batch.append(items[index])
+        batch_size += sizes[index]
+    if len(batch) > 0:
+        batches.append((batch, batch_size))
+    return batches
+
+# Runs in the worker process: the function is applied to every item of the batch
+
+def run_batch(function, batch):
+    start = time.perf_counter()
+    results = [function(item) for item in batch]
+    return os.getpid(), results, time.perf_counter() - start
+
+###############################################################################
+# Below function applies function to all items in a pool of worker processes and yields the results batch by batch (in order of completion)
+# The function has to be defined at module level so that it can be sent to the worker processes
+# stats (if given) is filled with the batches, items, bytes and seconds per worker process
+
+def run_scheduled(function, items, sizes, workers=None, stats=None, batch_bytes=batch_bytes, batch_items=batch_items):
+    workers = workers or os.cpu_count()
+    # Small jobs get smaller batches, so that every worker still gets a few of them
+    minimum_batches = workers * batches_per_worker * 2
+    batch_bytes = min(batch_bytes, max(1, sum(sizes) // minimum_batches))
+    batch_items = min(batch_items, max(1, len(items) // minimum_batches))
+    batches = make_batches(items, sizes, batch_bytes, batch_items)
+    if stats is None:
+        stats = {}
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        pending = {}
+        next_batch = 0
+        while next_batch < len(batches) or len(pending) > 0:
+            while next_batch < len(batches) and len(pending) < workers * batches_per_worker:
+                batch, batch_size = batches[next_batch]
+                pending[pool.submit(run_batch, function, batch)] = (len(batch), batch_size)
+                next_batch += 1
+
+            done, not_done = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                number_of_items, batch_size = pending.pop(future)
+                pid, results, seconds = future.result()
+                worker_stats = stats.setdefault(pid, {'batches': 0, 'items': 0, 'bytes': 0, 'seconds': 0.0})
+                worker_stats['batches'] += 1
+                worker_stats['items'] += number_of_items
+                worker_stats['bytes'] += batch_size
+                worker_stats['seconds'] += seconds
+                yield results
+
+# One line per worker process with its throughput
+
+def worker_report(stats):
+    lines = []
+    for pid, worker_stats in sorted(stats.items()):
+        seconds = max(worker_stats['seconds'], 1e-9)
+        lines.append('Worker {0}: {1} batches, {2} items, {3:.1f} MB in {4:.1f} s ({5:.2f} MB/s, {6:.1f} items/s)'.format(
+            pid, worker_stats['batches'], worker_stats['items'], worker_stats['bytes'] / 1024**2,
+            worker_stats['seconds'], worker_stats['bytes'] / 1024**2 / seconds, worker_stats['items'] / seconds))
+    return lines